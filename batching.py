@@ -0,0 +1,220 @@
+import io
+import json
+import time
+import asyncio
+
+
+BATCH_PROVIDERS = ("openai", "anthropic")
+ANTHROPIC_BATCH_BETA = {"anthropic-beta": "message-batches-2024-09-24"}
+OPENAI_TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchError(Exception):
+    pass
+
+
+class BatchResult:
+    def __init__(self, text=None, usage=None, error=None):
+        self.text = text
+        self.usage = usage or {}
+        self.error = error
+
+
+def conversation_messages(conversation):
+    if isinstance(conversation, str):
+        return [{"role": "user", "content": conversation}]
+    return [dict(message) for message in conversation]
+
+
+def split_system(conversation, default_system):
+    system = default_system
+    messages = []
+    for message in conversation_messages(conversation):
+        if message["role"] == "system":
+            system = message["content"]
+        else:
+            messages.append(message)
+    return system, messages
+
+
+def openai_batch_lines(model, system_message, conversations, max_tokens, kwargs):
+    lines = []
+    for i, conversation in enumerate(conversations):
+        system, messages = split_system(conversation, system_message)
+        body = {
+            "model": model,
+            "messages": [{"role": "system", "content": system}] + messages,
+            "max_tokens": max_tokens,
+            **kwargs,
+        }
+        lines.append(
+            {
+                "custom_id": f"request-{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }
+        )
+    return "\n".join(json.dumps(line) for line in lines).encode("utf-8")
+
+
+def anthropic_batch_requests(model, system_message, conversations, max_tokens, kwargs):
+    requests = []
+    for i, conversation in enumerate(conversations):
+        system, messages = split_system(conversation, system_message)
+        requests.append(
+            {
+                "custom_id": f"request-{i}",
+                "params": {
+                    "model": model,
+                    "system": system,
+                    "messages": messages,
+                    "max_tokens": max_tokens,
+                    **kwargs,
+                },
+            }
+        )
+    return {"requests": requests}
+
+
+def _index(custom_id):
+    return int(custom_id.rsplit("-", 1)[1])
+
+
+def parse_openai_results(text, count):
+    results = [
+        BatchResult(error=BatchError("Missing batch result")) for _ in range(count)
+    ]
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        index = _index(entry["custom_id"])
+        response = entry.get("response") or {}
+        if entry.get("error") or response.get("status_code") != 200:
+            results[index] = BatchResult(
+                error=BatchError(json.dumps(entry.get("error") or response.get("body")))
+            )
+            continue
+        body = response["body"]
+        usage = body.get("usage") or {}
+        results[index] = BatchResult(
+            text=body["choices"][0]["message"]["content"],
+            usage={
+                "input_tokens": usage.get("prompt_tokens"),
+                "output_tokens": usage.get("completion_tokens"),
+            },
+        )
+    return results
+
+
+def parse_anthropic_results(text, count):
+    results = [
+        BatchResult(error=BatchError("Missing batch result")) for _ in range(count)
+    ]
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        index = _index(entry["custom_id"])
+        result = entry["result"]
+        if result["type"] != "succeeded":
+            results[index] = BatchResult(error=BatchError(json.dumps(result)))
+            continue
+        message = result["message"]
+        results[index] = BatchResult(
+            text="".join(
+                block.get("text", "")
+                for block in message["content"]
+                if block["type"] == "text"
+            ),
+            usage=message.get("usage") or {},
+        )
+    return results
+
+
+def _check_deadline(started, timeout, batch_id):
+    if timeout is not None and time.monotonic() - started > timeout:
+        raise BatchError(f"Batch {batch_id} did not finish within {timeout} seconds")
+
+
+def run_openai_batch(client, payload, count, poll_interval, timeout):
+    started = time.monotonic()
+    batch_file = client.files.create(
+        file=("batch.jsonl", io.BytesIO(payload)), purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    while batch.status not in OPENAI_TERMINAL_STATES:
+        _check_deadline(started, timeout, batch.id)
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+    if batch.status != "completed":
+        raise BatchError(f"Batch {batch.id} ended with status {batch.status}")
+    text = ""
+    if batch.output_file_id:
+        text += client.files.content(batch.output_file_id).text + "\n"
+    if batch.error_file_id:
+        text += client.files.content(batch.error_file_id).text
+    return parse_openai_results(text, count)
+
+
+async def run_openai_batch_async(client, payload, count, poll_interval, timeout):
+    started = time.monotonic()
+    batch_file = await client.files.create(
+        file=("batch.jsonl", io.BytesIO(payload)), purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    while batch.status not in OPENAI_TERMINAL_STATES:
+        _check_deadline(started, timeout, batch.id)
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+    if batch.status != "completed":
+        raise BatchError(f"Batch {batch.id} ended with status {batch.status}")
+    text = ""
+    if batch.output_file_id:
+        text += (await client.files.content(batch.output_file_id)).text + "\n"
+    if batch.error_file_id:
+        text += (await client.files.content(batch.error_file_id)).text
+    return parse_openai_results(text, count)
+
+
+# anthropic==0.34 has no batch resource yet, so the Message Batches API is called
+# through the client's generic request methods.
+def run_anthropic_batch(client, payload, count, poll_interval, timeout):
+    started = time.monotonic()
+    options = {"headers": ANTHROPIC_BATCH_BETA}
+    batch = client.post(
+        "/v1/messages/batches", body=payload, cast_to=object, options=options
+    )
+    while batch["processing_status"] != "ended":
+        _check_deadline(started, timeout, batch["id"])
+        time.sleep(poll_interval)
+        batch = client.get(
+            f"/v1/messages/batches/{batch['id']}", cast_to=object, options=options
+        )
+    text = client.get(batch["results_url"], cast_to=str, options=options)
+    return parse_anthropic_results(text, count)
+
+
+async def run_anthropic_batch_async(client, payload, count, poll_interval, timeout):
+    started = time.monotonic()
+    options = {"headers": ANTHROPIC_BATCH_BETA}
+    batch = await client.post(
+        "/v1/messages/batches", body=payload, cast_to=object, options=options
+    )
+    while batch["processing_status"] != "ended":
+        _check_deadline(started, timeout, batch["id"])
+        await asyncio.sleep(poll_interval)
+        batch = await client.get(
+            f"/v1/messages/batches/{batch['id']}", cast_to=object, options=options
+        )
+    text = await client.get(batch["results_url"], cast_to=str, options=options)
+    return parse_anthropic_results(text, count)
@@ -0,0 +1,400 @@
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import contextlib
+import tempfile
+import threading
+import subprocess
+import httpx
+from local_provider import LocalProvider
+from code_runner import CodeRunner
+from fork_server import ForkServerRunner
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean": statistics.fmean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "min": samples[0],
+        "max": samples[-1],
+    }
+
+
+IMPORT_PROBE = """
+import io, sys, json, time, contextlib
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import {module}
+seconds = time.perf_counter() - start
+sdk_modules = [m for m in ("openai", "anthropic", "pydantic", "httpx") if m in sys.modules]
+print(json.dumps({{"seconds": seconds, "sdk_modules": sdk_modules}}))
+"""
+
+
+def bench_import_time(modules, runs, budget):
+    # Each sample is a fresh interpreter, which is what a short-lived batch worker pays.
+    results = {}
+    for module in modules:
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-c", IMPORT_PROBE.format(module=module)],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            sample = json.loads(output.splitlines()[-1])
+            samples.append(sample["seconds"])
+        results[module] = summarize(samples)
+        results[module]["sdk_modules"] = sample["sdk_modules"]
+        results[module]["budget"] = budget
+        results[module]["within_budget"] = results[module]["p50"] <= budget
+    return results
+
+
+def new_agent(provider="local", **kwargs):
+    from unified import UnifiedApis
+    from terminal_renderer import TerminalRenderer
+
+    # Throughput runs skip terminal rendering entirely.
+    kwargs.setdefault("renderer", TerminalRenderer(headless=True))
+    return UnifiedApis(provider=provider, should_print_init=False, **kwargs)
+
+
+def bench_call_overhead(server, calls):
+    # Same request through raw httpx and through UnifiedApis; the difference is client overhead.
+    server.latency = server.time_to_first_token = 0
+    server.tokens_per_second = None
+    body = {
+        "model": "local-model",
+        "messages": [{"role": "user", "content": "ping"}],
+        "max_tokens": 4000,
+    }
+    raw = []
+    with httpx.Client() as client:
+        client.post(f"{server.openai_base_url}/chat/completions", json=body)
+        for _ in range(calls):
+            start = time.perf_counter()
+            client.post(f"{server.openai_base_url}/chat/completions", json=body)
+            raw.append(time.perf_counter() - start)
+
+    results = {"raw_http": summarize(raw)}
+    for provider in ("local", "anthropic"):
+        agent = new_agent(provider, stream=False)
+        # The first call pays for lazy SDK imports and the connection handshake.
+        agent.chat("warm up", should_print=False)
+        samples = []
+        for _ in range(calls):
+            agent.clear_history()
+            start = time.perf_counter()
+            agent.chat("ping", should_print=False)
+            samples.append(time.perf_counter() - start)
+        results[provider] = summarize(samples)
+        results[provider]["overhead_mean"] = (
+            results[provider]["mean"] - results["raw_http"]["mean"]
+        )
+    return results
+
+
+def bench_streaming(server, calls, ttft, tokens_per_second):
+    server.latency = 0
+    server.time_to_first_token = ttft
+    server.tokens_per_second = tokens_per_second
+    results = {}
+    for provider in ("local", "anthropic"):
+        agent = new_agent(provider)
+        first_token, throughput = [], []
+        for _ in range(calls):
+            agent.clear_history()
+            start = time.perf_counter()
+            first = None
+            chunks = 0
+            for event in agent.chat_stream("stream please"):
+                if event.type == "text":
+                    chunks += 1
+                    if first is None:
+                        first = time.perf_counter() - start
+            elapsed = time.perf_counter() - start
+            first_token.append(first)
+            throughput.append(chunks / max(elapsed - first, 1e-9))
+        results[provider] = {
+            "time_to_first_token": summarize(first_token),
+            "chunks_per_second": summarize(throughput),
+        }
+    return results
+
+
+def bench_trim_history(sizes, operations):
+    results = {}
+    for size in sizes:
+        agent = new_agent(max_history_words=size * 50)
+        message = " ".join(["token"] * 50)
+        for _ in range(size):
+            agent.add_message("user", message)
+        start = time.perf_counter()
+        for _ in range(operations):
+            agent.add_message("user", message)
+            agent.trim_history()
+        elapsed = time.perf_counter() - start
+        results[str(size)] = {"seconds_per_op": elapsed / operations}
+    return results
+
+
+def bench_fan_out(server, widths, rounds, ttft, tokens_per_second):
+    server.latency = 0
+    server.time_to_first_token = ttft
+    server.tokens_per_second = tokens_per_second
+
+    async def run(width):
+        # Identical prompts would otherwise be coalesced into a single request.
+        agents = [new_agent(use_async=True, coalesce=False) for _ in range(width)]
+        start = time.perf_counter()
+        for _ in range(rounds):
+            await asyncio.gather(
+                *[agent.chat_async("fan out", should_print=False) for agent in agents]
+            )
+        return time.perf_counter() - start
+
+    results = {}
+    for width in widths:
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed = asyncio.run(run(width))
+        results[str(width)] = {
+            "seconds": elapsed,
+            "requests_per_second": width * rounds / elapsed,
+        }
+    return results
+
+
+def bench_teams(server, member_counts, iterations, topologies, ttft, tokens_per_second):
+    server.latency = 0
+    server.time_to_first_token = ttft
+    server.tokens_per_second = tokens_per_second
+    with contextlib.redirect_stdout(io.StringIO()):
+        import multi_agent_coding_team as coding
+        import coder_team_original as coder
+
+    member_factories = [
+        lambda: coding.ProjectLead("Alice"),
+        lambda: coding.SoftwareArchitect("Frank"),
+        lambda: coding.QualityAssuranceEngineer("Grace"),
+        lambda: coding.AISpecialist("Bob"),
+        lambda: coding.UIUXDesigner("Charlie"),
+        lambda: coding.BackendDeveloper("David"),
+        lambda: coding.FrontendDeveloper("Eve"),
+    ]
+    results = {"CodingTeam": {}, "CoderTeam": {}}
+    for count in member_counts:
+        for rounds in iterations:
+            key = f"members={count},iterations={rounds}"
+            for topology in topologies:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    team = coding.CodingTeam(
+                        members=[factory() for factory in member_factories[:count]]
+                    )
+                    asyncio.run(
+                        team.discuss_project("A todo list CLI", rounds, topology)
+                    )
+                metrics = team.discussion_metrics
+                results["CodingTeam"][f"{key},topology={topology}"] = {
+                    "seconds": metrics["seconds"],
+                    "topology": metrics["topology"],
+                    "waves": len(metrics["waves"]),
+                }
+            with contextlib.redirect_stdout(io.StringIO()):
+                coder_team = coder.CoderTeam()
+                coder_team.models = (coder_team.all_models * count)[:count]
+                start = time.perf_counter()
+                asyncio.run(coder_team.discuss_project("A todo list CLI", rounds, True))
+                coder_elapsed = time.perf_counter() - start
+            results["CoderTeam"][key] = {"seconds": coder_elapsed}
+    return results
+
+
+def bench_runners(modules, runs):
+    # A cold interpreter per run against a fork of a warm one with the modules loaded.
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "candidate.py")
+        with open(path, "w") as f:
+            f.write(f"import {', '.join(modules)}\nprint('ok')\n")
+        runners = {"cold": CodeRunner()}
+        if hasattr(os, "fork"):
+            runners["fork_server"] = ForkServerRunner(preload=modules, workers=1)
+        for name, runner in runners.items():
+            # The first run starts the fork server's worker.
+            runner.run(path)
+            samples = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                result = runner.run(path)
+                samples.append(time.perf_counter() - start)
+            results[name] = summarize(samples)
+            results[name]["ok"] = result.ok
+            if isinstance(runner, ForkServerRunner):
+                results[name]["worker_crash"] = check_worker_crash(runner, directory)
+                runner.close()
+    return results
+
+
+def check_worker_crash(runner, directory):
+    # A program that kills its fork server worker must still return a result
+    # (from the fallback interpreter, whose parent is this process) in time.
+    path = os.path.join(directory, "kill_worker.py")
+    with open(path, "w") as f:
+        f.write(
+            "import os, signal\n"
+            f"if os.getppid() != {os.getpid()}:\n"
+            "    os.kill(os.getppid(), signal.SIGKILL)\n"
+            "print('ok')\n"
+        )
+    outcome = {}
+    thread = threading.Thread(
+        target=lambda: outcome.update(result=runner.run(path)), daemon=True
+    )
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        thread.start()
+        thread.join(2 * runner.timeout)
+    return {
+        "seconds": time.perf_counter() - start,
+        "recovered": "result" in outcome and outcome["result"].ok,
+    }
+
+
+def run_benchmarks(args):
+    import_time = bench_import_time(args.import_modules, args.calls, args.import_budget)
+    server = LocalProvider(reply_words=args.reply_words, seed=0).start()
+    server.route_all()
+    results = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "benchmarks": {},
+    }
+    benchmarks = results["benchmarks"]
+    benchmarks["import_time"] = import_time
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            benchmarks["call_overhead"] = bench_call_overhead(server, args.calls)
+            benchmarks["streaming"] = bench_streaming(
+                server, args.calls, args.ttft, args.tokens_per_second
+            )
+            benchmarks["trim_history"] = bench_trim_history(
+                args.history_sizes, args.calls * 10
+            )
+        benchmarks["runners"] = bench_runners(args.runner_modules, args.calls)
+        benchmarks["fan_out"] = bench_fan_out(
+            server, args.fan_out, args.rounds, args.ttft, args.tokens_per_second
+        )
+        benchmarks["teams"] = bench_teams(
+            server,
+            args.members,
+            args.iterations,
+            args.topologies,
+            args.ttft,
+            args.tokens_per_second,
+        )
+    finally:
+        server.stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark UnifiedApis and the team pipelines against the local provider."
+    )
+    parser.add_argument("--output", help="Write JSON results to this file")
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--reply-words", type=int, default=200)
+    parser.add_argument("--ttft", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=2000)
+    parser.add_argument(
+        "--history-sizes", type=int, nargs="+", default=[100, 1000, 10000]
+    )
+    parser.add_argument("--fan-out", type=int, nargs="+", default=[1, 7, 32])
+    parser.add_argument("--members", type=int, nargs="+", default=[3, 7])
+    parser.add_argument("--iterations", type=int, nargs="+", default=[1, 2])
+    parser.add_argument(
+        "--topologies",
+        nargs="+",
+        default=["sequential", "parallel", "architect-first"],
+        help="Discussion topologies to compare for CodingTeam",
+    )
+    parser.add_argument(
+        "--runner-modules",
+        nargs="+",
+        default=["asyncio", "json", "httpx"],
+        help="Modules the generated-code runner benchmark imports (and the fork server preloads)",
+    )
+    parser.add_argument(
+        "--import-modules",
+        nargs="+",
+        default=["unified", "multi_agent_coding_team", "coder_team_original"],
+    )
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=0.25,
+        help="Median seconds allowed for importing each module",
+    )
+    parser.add_argument(
+        "--import-only",
+        action="store_true",
+        help="Only measure import time; exit with status 1 if a module is over budget",
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="Small sizes for a smoke run"
+    )
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.calls = 3
+        args.rounds = 1
+        args.history_sizes = [100, 1000]
+        args.fan_out = [1, 7]
+        args.members = [3]
+        args.iterations = [1]
+
+    if args.import_only:
+        results = {
+            "benchmarks": {
+                "import_time": bench_import_time(
+                    args.import_modules, args.calls, args.import_budget
+                )
+            }
+        }
+    else:
+        results = run_benchmarks(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+    if args.import_only and not all(
+        result["within_budget"]
+        for result in results["benchmarks"]["import_time"].values()
+    ):
+        sys.exit(1)
+    fork_server = results["benchmarks"].get("runners", {}).get("fork_server")
+    if fork_server and not fork_server["worker_crash"]["recovered"]:
+        sys.exit(1)
+    return results
+
+
+if __name__ == "__main__":
+    main()
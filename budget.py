@@ -0,0 +1,233 @@
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from termcolor import colored
+
+
+# USD per million tokens: (input, output, cache read, cache write).
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60, 0.075, 0.15),
+    "gpt-4o": (2.50, 10.00, 1.25, 2.50),
+    "claude-3-5-sonnet": (3.00, 15.00, 0.30, 3.75),
+    "claude-3-haiku": (0.25, 1.25, 0.03, 0.30),
+    "claude-3-opus": (15.00, 75.00, 1.50, 18.75),
+    "google/gemini-pro-1.5": (1.25, 5.00, 1.25, 1.25),
+    "google/gemini-flash-1.5": (0.075, 0.30, 0.075, 0.075),
+    "deepseek/deepseek-coder": (0.14, 0.28, 0.14, 0.14),
+    "local-model": (0.0, 0.0, 0.0, 0.0),
+}
+
+# The pipeline phase the current thread or asyncio task is booking to. Kept per
+# context, so concurrent jobs sharing a ledger never see each other's phase.
+active_phase = ContextVar("active_phase", default=None)
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, message, budget=None, phase=None):
+        super().__init__(message)
+        self.budget = budget
+        self.phase = phase
+
+
+def model_prices(model, prices=None):
+    # Exact match first, then the longest prefix, so dated snapshots such as
+    # gpt-4o-2024-08-06 use their family's price.
+    prices = prices or PRICES
+    if model in prices:
+        return prices[model]
+    matches = [name for name in prices if model and model.startswith(name)]
+    return prices[max(matches, key=len)] if matches else None
+
+
+def call_cost(record, prices=None):
+    price = model_prices(record.model, prices)
+    if price is None:
+        return None
+    input_price, output_price, read_price, write_price = price
+    input_tokens = record.input_tokens or 0
+    cache_read = record.cache_read_input_tokens or 0
+    cache_write = record.cache_creation_input_tokens or 0
+    if record.provider != "anthropic":
+        # OpenAI-style usage counts cached tokens as part of the prompt tokens.
+        input_tokens = max(0, input_tokens - cache_read)
+    return (
+        input_tokens * input_price
+        + (record.output_tokens or 0) * output_price
+        + cache_read * read_price
+        + cache_write * write_price
+    ) / 1_000_000
+
+
+def call_tokens(record):
+    return sum(
+        getattr(record, name) or 0
+        for name in (
+            "input_tokens",
+            "output_tokens",
+            "cache_read_input_tokens",
+            "cache_creation_input_tokens",
+        )
+    )
+
+
+class Budget:
+    """Token and cost ledger with soft warnings and hard stops, per agent, team and phase."""
+
+    def __init__(
+        self,
+        name="budget",
+        max_cost=None,
+        max_tokens=None,
+        warn_at=0.8,
+        phases=None,
+        parent=None,
+        prices=None,
+    ):
+        self.name = name
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self.warn_at = warn_at
+        # {"discussion": {"max_cost": 1.0, "max_tokens": 200000}, ...}
+        self.phases = phases or {}
+        self.parent = parent
+        self.prices = prices
+        self.cost = 0.0
+        self.tokens = 0
+        self.calls = 0
+        self.phase_cost = {}
+        self.phase_tokens = {}
+        self._warned = set()
+        self._unpriced = set()
+        self._lock = threading.Lock()
+
+    def child(self, name, max_cost=None, max_tokens=None, warn_at=None):
+        return Budget(
+            name=name,
+            max_cost=max_cost,
+            max_tokens=max_tokens,
+            warn_at=self.warn_at if warn_at is None else warn_at,
+            parent=self,
+            prices=self.prices,
+        )
+
+    @property
+    def root(self):
+        budget = self
+        while budget.parent is not None:
+            budget = budget.parent
+        return budget
+
+    @property
+    def current_phase(self):
+        return active_phase.get()
+
+    @contextmanager
+    def phase(self, name):
+        token = active_phase.set(name)
+        try:
+            yield self
+        finally:
+            active_phase.reset(token)
+
+    def _limits(self, phase):
+        yield self.name, self.max_cost, self.max_tokens, self.cost, self.tokens
+        limits = self.phases.get(phase)
+        if phase is not None and limits:
+            yield (
+                f"{self.name} {phase}",
+                limits.get("max_cost"),
+                limits.get("max_tokens"),
+                self.phase_cost.get(phase, 0.0),
+                self.phase_tokens.get(phase, 0),
+            )
+
+    def check(self):
+        # Called before each request: a ledger (or its current phase) that is already
+        # at its limit stops the call instead of letting it spend more.
+        phase = self.current_phase
+        budget = self
+        while budget is not None:
+            with budget._lock:
+                limits = list(budget._limits(phase))
+            for name, max_cost, max_tokens, cost, tokens in limits:
+                if max_cost is not None and cost >= max_cost:
+                    raise BudgetExceeded(
+                        f"{name} budget of ${max_cost:.2f} exhausted (spent ${cost:.4f})",
+                        budget,
+                        phase,
+                    )
+                if max_tokens is not None and tokens >= max_tokens:
+                    raise BudgetExceeded(
+                        f"{name} budget of {max_tokens} tokens exhausted (used {tokens})",
+                        budget,
+                        phase,
+                    )
+            budget = budget.parent
+
+    def record(self, record):
+        if record.cached or record.coalesced:
+            return
+        cost = call_cost(record, self.prices)
+        if cost is None and record.model not in self._unpriced:
+            self._unpriced.add(record.model)
+            print(
+                colored(f"No price for model {record.model}; cost not counted", "red")
+            )
+        self._add(cost or 0.0, call_tokens(record), self.current_phase)
+
+    def _add(self, cost, tokens, phase):
+        with self._lock:
+            self.cost += cost
+            self.tokens += tokens
+            self.calls += 1
+            if phase is not None:
+                self.phase_cost[phase] = self.phase_cost.get(phase, 0.0) + cost
+                self.phase_tokens[phase] = self.phase_tokens.get(phase, 0) + tokens
+            warnings = []
+            for name, max_cost, max_tokens, spent, used in self._limits(phase):
+                if max_cost and spent >= max_cost * self.warn_at:
+                    if (name, "cost") not in self._warned:
+                        self._warned.add((name, "cost"))
+                        warnings.append(
+                            f"{name} has spent ${spent:.4f} of its ${max_cost:.2f} budget"
+                        )
+                if max_tokens and used >= max_tokens * self.warn_at:
+                    if (name, "tokens") not in self._warned:
+                        self._warned.add((name, "tokens"))
+                        warnings.append(
+                            f"{name} has used {used} of its {max_tokens} token budget"
+                        )
+        for message in warnings:
+            print(colored(f"Budget warning: {message}", "yellow"))
+        if self.parent is not None:
+            self.parent._add(cost, tokens, phase)
+
+    def summary(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "calls": self.calls,
+                "cost": self.cost,
+                "tokens": self.tokens,
+                "max_cost": self.max_cost,
+                "max_tokens": self.max_tokens,
+                "phase_cost": dict(self.phase_cost),
+                "phase_tokens": dict(self.phase_tokens),
+            }
+
+
+def budget_phase(name):
+    # Decorates an async team method so the calls it makes are booked to a phase of
+    # the team's budget (if it has one).
+    def decorate(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            if self.budget is None:
+                return await method(self, *args, **kwargs)
+            with self.budget.phase(name):
+                return await method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,118 @@
+import asyncio
+import inspect
+import weakref
+import threading
+
+
+_pool_settings = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "timeout": 600.0,
+}
+_clients = {}
+# Async connections are bound to the event loop that opened them, so async clients
+# are pooled per running loop and dropped together with it.
+_loop_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def configure_client_pool(
+    max_connections=None,
+    max_keepalive_connections=None,
+    keepalive_expiry=None,
+    timeout=None,
+):
+    # Applies to clients created after the call; existing pooled clients keep their limits.
+    updates = {
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive_connections,
+        "keepalive_expiry": keepalive_expiry,
+        "timeout": timeout,
+    }
+    with _lock:
+        _pool_settings.update({k: v for k, v in updates.items() if v is not None})
+
+
+def pool_timeout():
+    return _pool_settings["timeout"]
+
+
+def _http_client(use_async):
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=_pool_settings["max_connections"],
+        max_keepalive_connections=_pool_settings["max_keepalive_connections"],
+        keepalive_expiry=_pool_settings["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(_pool_settings["timeout"], connect=5.0)
+    if use_async:
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+    return httpx.Client(limits=limits, timeout=timeout)
+
+
+def _build_client(provider, api_key, use_async, base_url):
+    # The SDKs take most of the import time, so they are loaded with the first client.
+    if provider in ("openai", "openrouter", "local"):
+        from openai import OpenAI, AsyncOpenAI
+
+        client_class = AsyncOpenAI if use_async else OpenAI
+    elif provider == "anthropic":
+        from anthropic import Anthropic, AsyncAnthropic
+
+        client_class = AsyncAnthropic if use_async else Anthropic
+    else:
+        raise ValueError(f"Unsupported provider: {provider}")
+    http_client = _http_client(use_async)
+    # UnifiedApis applies its own RetryPolicy, so SDK-level retries are disabled.
+    return client_class(
+        api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0
+    )
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def get_client(provider, api_key, use_async, base_url=None):
+    key = (provider, base_url, api_key, use_async)
+    with _lock:
+        clients = _clients
+        if use_async:
+            loop = _running_loop()
+            if loop is not None:
+                clients = _loop_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = _build_client(provider, api_key, use_async, base_url)
+            clients[key] = client
+        return client
+
+
+def new_client(provider, api_key, use_async, base_url=None):
+    with _lock:
+        return _build_client(provider, api_key, use_async, base_url)
+
+
+def close_clients():
+    # Async clients can only be closed from inside an event loop; see aclose_clients.
+    with _lock:
+        sync_keys = [key for key in _clients if not key[3]]
+        clients = [_clients.pop(key) for key in sync_keys]
+    for client in clients:
+        client.close()
+
+
+async def aclose_clients():
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        clients.extend(_loop_clients.pop(asyncio.get_running_loop(), {}).values())
+    for client in clients:
+        closed = client.close()
+        if inspect.isawaitable(closed):
+            await closed
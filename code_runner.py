@@ -0,0 +1,288 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import threading
+import subprocess
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # Windows: only the wall-clock and output limits apply
+    resource = None
+
+
+LIMITS = {
+    "timeout": "wall-clock time limit reached",
+    "cpu": "CPU time limit reached",
+    "memory": "memory limit reached",
+    "output": "output size limit reached",
+}
+
+# How the kernel ends a process that exceeds RLIMIT_CPU (soft, then hard limit).
+CPU_SIGNALS = {-signal.SIGKILL} | (
+    {-signal.SIGXCPU} if hasattr(signal, "SIGXCPU") else set()
+)
+
+# Applies the limits and then execs the program. Setting them in the child of a
+# threaded process through preexec_fn is unsafe, so a small launcher does it.
+LAUNCHER = """
+import os, sys, resource
+cpu, memory = int(sys.argv[1]), int(sys.argv[2])
+resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+if cpu:
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+if memory:
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+os.execv(sys.argv[3], sys.argv[3:])
+"""
+
+
+def apply_rlimits(cpu, memory):
+    # Same limits as LAUNCHER, for a child that is already running (a fork server).
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    if cpu:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    if memory:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+
+@dataclass
+class RunResult:
+    exit_code: Optional[int]
+    stdout: str
+    stderr: str
+    duration: float
+    # Bytes; None where the platform cannot report it.
+    peak_rss: Optional[int] = None
+    cpu_seconds: Optional[float] = None
+    # Set when the sandbox stopped the program: a key of LIMITS.
+    limit: Optional[str] = None
+    stdout_truncated: bool = False
+    stderr_truncated: bool = False
+
+    @property
+    def ok(self):
+        return self.exit_code == 0 and self.limit is None
+
+    @property
+    def needs_input(self):
+        lines = self.stderr.strip().splitlines()
+        return bool(lines) and lines[-1].startswith("EOFError")
+
+    @property
+    def busy(self):
+        # Spent (nearly) all of its wall-clock time on the CPU: a busy loop rather
+        # than a server or game loop waiting for events.
+        return self.cpu_seconds is not None and self.cpu_seconds >= 0.9 * self.duration
+
+    @property
+    def crashed(self):
+        # Servers log to stderr too, so only a traceback counts as a crash there.
+        return "Traceback (most recent call last)" in self.stderr
+
+    @property
+    def inconclusive(self):
+        # The program was only stopped because it waited for input or kept running
+        # idle (a server, a game loop); that is not an error to correct.
+        return self.needs_input or (
+            self.limit == "timeout" and not self.crashed and not self.busy
+        )
+
+    def note(self):
+        if self.needs_input:
+            return "Code ran without errors until it asked for input (stdin is closed during checks)."
+        return f"Code ran without errors for {self.duration:.1f}s and was stopped ({LIMITS[self.limit]})."
+
+    def report(self):
+        # What the error corrector is shown about a failed run.
+        if self.limit:
+            parts = [
+                f"The program was stopped after {self.duration:.1f}s: {LIMITS[self.limit]}."
+            ]
+        else:
+            parts = [f"The program exited with code {self.exit_code}."]
+        if self.stderr.strip():
+            truncated = " (truncated)" if self.stderr_truncated else ""
+            parts.append(f"Stderr{truncated}:\n{self.stderr}")
+        if self.stdout.strip():
+            truncated = " (truncated)" if self.stdout_truncated else ""
+            parts.append(f"Stdout{truncated}:\n{self.stdout}")
+        return "\n\n".join(parts)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def clip_output(data, max_bytes):
+    # Keeps the start and the end of the output; a traceback is always at the end.
+    if len(data) <= max_bytes:
+        return data.decode("utf-8", errors="replace"), False
+    half = max_bytes // 2
+    skipped = len(data) - 2 * half
+    text = (
+        data[:half].decode("utf-8", errors="replace")
+        + f"\n... [{skipped} bytes truncated] ...\n"
+        + data[len(data) - half :].decode("utf-8", errors="replace")
+    )
+    return text, True
+
+
+class CodeRunner:
+    """Runs a generated program in a child process under time, memory and output limits."""
+
+    def __init__(
+        self,
+        timeout=30,
+        cpu_time=None,
+        memory_mb=2048,
+        max_output=20_000,
+        output_limit=8_000_000,
+        max_attempts=5,
+        python=None,
+        env=None,
+    ):
+        self.timeout = timeout
+        # Defaults to half the wall-clock timeout, so a busy loop is stopped as a
+        # CPU limit failure before the timer treats it as a program left running.
+        self.cpu_time = max(1, timeout / 2) if cpu_time is None else cpu_time
+        # Address space limit; None disables it.
+        self.memory_mb = memory_mb
+        # Bytes of each stream kept in the result, and total bytes after which the
+        # program is stopped.
+        self.max_output = max_output
+        self.output_limit = output_limit
+        # How many corrected versions error_correction_cycle tries before giving up.
+        self.max_attempts = max_attempts
+        self.python = python or sys.executable
+        self.env = env
+
+    def _child_env(self):
+        env = dict(os.environ if self.env is None else self.env)
+        # Output written before a kill still reaches the result.
+        env["PYTHONUNBUFFERED"] = "1"
+        return env
+
+    def _rlimits(self):
+        # (CPU seconds, address space bytes); 0 leaves a limit unset.
+        cpu = int(max(1, self.cpu_time)) if self.cpu_time else 0
+        memory = int(self.memory_mb * 1024 * 1024) if self.memory_mb else 0
+        return cpu, memory
+
+    def _command(self, file_path):
+        if resource is None:
+            return [self.python, file_path]
+        cpu, memory = self._rlimits()
+        return [self.python, "-I", "-S", "-c", LAUNCHER, str(cpu), str(memory)] + [
+            self.python,
+            file_path,
+        ]
+
+    def run(self, file_path):
+        started = time.monotonic()
+        process = subprocess.Popen(
+            self._command(file_path),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=self._child_env(),
+            start_new_session=os.name == "posix",
+        )
+        return self._supervise(
+            process.pid,
+            process.stdout,
+            process.stderr,
+            started,
+            process=process,
+        )
+
+    async def run_async(self, file_path):
+        return await asyncio.to_thread(self.run, file_path)
+
+    def _supervise(self, pid, stdout, stderr, started, process=None):
+        stopped, finished = [], []
+        outputs = [bytearray(), bytearray()]
+        lock = threading.Lock()
+
+        def stop(reason):
+            with lock:
+                if finished or stopped:
+                    return
+                stopped.append(reason)
+            self._kill(pid, process)
+
+        def drain(stream, buffer):
+            while True:
+                data = stream.read1(65536)
+                if not data:
+                    break
+                with lock:
+                    buffer.extend(data)
+                    total = len(outputs[0]) + len(outputs[1])
+                if total > self.output_limit:
+                    stop("output")
+                    break
+            stream.close()
+
+        readers = [
+            threading.Thread(target=drain, args=(stream, buffer), daemon=True)
+            for stream, buffer in zip((stdout, stderr), outputs)
+        ]
+        for reader in readers:
+            reader.start()
+        timer = threading.Timer(self.timeout, stop, ("timeout",))
+        timer.daemon = True
+        timer.start()
+        try:
+            exit_code, peak_rss, cpu_seconds = self._wait(pid, process)
+        finally:
+            with lock:
+                finished.append(True)
+            timer.cancel()
+            # Also ends anything the program left running in its process group.
+            self._kill(pid, process)
+        for reader in readers:
+            reader.join()
+        duration = time.monotonic() - started
+
+        stdout_text, stdout_truncated = clip_output(bytes(outputs[0]), self.max_output)
+        stderr_text, stderr_truncated = clip_output(bytes(outputs[1]), self.max_output)
+        limit = stopped[0] if stopped else None
+        if limit is None and exit_code in CPU_SIGNALS:
+            limit = "cpu"
+        elif limit is None and exit_code and "MemoryError" in stderr_text[-500:]:
+            limit = "memory"
+        return RunResult(
+            exit_code=exit_code,
+            stdout=stdout_text,
+            stderr=stderr_text,
+            duration=duration,
+            peak_rss=peak_rss,
+            cpu_seconds=cpu_seconds,
+            limit=limit,
+            stdout_truncated=stdout_truncated,
+            stderr_truncated=stderr_truncated,
+        )
+
+    def _wait(self, pid, process):
+        if not hasattr(os, "wait4"):
+            return process.wait(), None, None
+        _, status, usage = os.wait4(pid, 0)
+        exit_code = os.waitstatus_to_exitcode(status)
+        if process is not None:
+            # Already reaped; keeps Popen from waiting on the pid again.
+            process.returncode = exit_code
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+        scale = 1 if sys.platform == "darwin" else 1024
+        return exit_code, usage.ru_maxrss * scale, usage.ru_utime + usage.ru_stime
+
+    def _kill(self, pid, process=None):
+        try:
+            if os.name == "posix":
+                os.killpg(pid, signal.SIGKILL)
+            elif process is not None and process.returncode is None:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
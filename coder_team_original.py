@@ -1,12 +1,14 @@
 import os
 from unified import UnifiedApis
+from structured_output import extract_tagged
+from budget import budget_phase
 import asyncio
-import subprocess
+from code_runner import CodeRunner
 from termcolor import colored
 
 
 class CoderTeam:
-    def __init__(self):
+    def __init__(self, budget=None, runner=None):
         self.all_models = [
             UnifiedApis(
                 name="Claude",
@@ -56,6 +58,17 @@ class CoderTeam:
             model="claude-3-5-sonnet-20240620",
             use_async=True,
         )
+        # Team-wide ledger; every agent books its calls to a child ledger of it.
+        self.budget = budget
+        # Runs the generated program with time, memory and output limits.
+        self.runner = runner or CodeRunner()
+        if budget is not None:
+            for agent in self.all_models + [
+                self.coder,
+                self.error_corrector,
+                self.code_improver,
+            ]:
+                agent.budget = budget.child(agent.name)
 
     def select_models(self):
         print(colored("Available models:", "cyan"))
@@ -96,6 +109,7 @@ class CoderTeam:
 
         return response
 
+    @budget_phase("discussion")
     async def discuss_project(
         self, project_description, iterations, independent_first_round
     ):
@@ -134,6 +148,7 @@ class CoderTeam:
                 discussion.extend(round_responses)
         return "\n".join(discussion)
 
+    @budget_phase("generation")
     async def generate_code(self, project_description, discussion, file_path):
         print(colored("\nGenerating initial code...", "blue"))
         system_message = "You are an expert programmer. Generate code based on the project description and team discussion. Consider all aspects of the app that is discussed and use the best provided suggestions to implement all suggested features. Do not skip over features. we do not need unit tests and error handling and information printing should be handled by print statements and not by logging. Do not use or refer to to any external files unless explicitly told to do so by the user. Wrap the code in <code> full code here </code> tags. return the full code as for a single file"
@@ -143,45 +158,58 @@ class CoderTeam:
             f"Project: {project_description}\n\nTeam Discussion:\n{discussion}\n\nGenerate the code for this project.",
         )
 
-        code = code_response.split("<code>")[1].split("</code>")[0].strip()
+        code = extract_tagged(code_response, "code")
         with open(file_path, "w") as f:
             f.write(code)
         print(colored(f"Initial code written to {file_path}", "green"))
         return code
 
+    @budget_phase("correction")
     async def error_correction_cycle(self, file_path):
         system_message = "You are an expert programmer tasked with fixing errors in code. Analyze the error message and the code, then provide the corrected full code wrapped in <code> tags."
         self.error_corrector.set_system_message(system_message)
 
-        while True:
+        max_attempts = self.runner.max_attempts
+        for attempt in range(max_attempts + 1):
             print(colored("\nExecuting code...", "cyan"))
-            try:
-                result = subprocess.run(
-                    ["python", file_path], capture_output=True, text=True, check=True
-                )
+            result = await self.runner.run_async(file_path)
+            if result.ok:
                 print(colored("Code execution successful!", "green"))
+                return result
+            if result.inconclusive:
+                print(colored(result.note(), "yellow"))
+                return result
+            error_message = result.report()
+            print(colored(f"Error detected: {error_message}", "red"))
+            if attempt == max_attempts:
                 break
-            except subprocess.CalledProcessError as e:
-                error_message = e.stderr
-                print(colored(f"Error detected: {error_message}", "red"))
-                with open(file_path, "r") as f:
-                    current_code = f.read()
+            with open(file_path, "r") as f:
+                current_code = f.read()
 
-                print(colored("Attempting to fix the error...", "yellow"))
-                correction_prompt = f"Error message:\n{error_message}\n\nCurrent code:\n{current_code}\n\nPlease fix the error and provide the full corrected code. "
-                corrected_code_response = await self.get_full_response(
-                    self.error_corrector, correction_prompt
+            print(
+                colored(
+                    f"Attempting to fix the error ({attempt + 1}/{max_attempts})...",
+                    "yellow",
                 )
+            )
+            correction_prompt = f"Error message:\n{error_message}\n\nCurrent code:\n{current_code}\n\nPlease fix the error and provide the full corrected code. "
+            corrected_code_response = await self.get_full_response(
+                self.error_corrector, correction_prompt
+            )
 
-                corrected_code = (
-                    corrected_code_response.split("<code>")[1]
-                    .split("</code>")[0]
-                    .strip()
-                )
-                with open(file_path, "w") as f:
-                    f.write(corrected_code)
-                print(colored("Applied fix. Retrying execution...", "magenta"))
+            corrected_code = extract_tagged(corrected_code_response, "code")
+            with open(file_path, "w") as f:
+                f.write(corrected_code)
+            print(colored("Applied fix. Retrying execution...", "magenta"))
+        print(
+            colored(
+                f"Giving up after {max_attempts} fix attempts; the code still fails.",
+                "red",
+            )
+        )
+        return result
 
+    @budget_phase("feedback")
     async def feedback_improvement_cycle(self, file_path, user_feedback):
         system_message = "You are an expert programmer tasked with improving code based on user feedback and team suggestions. Analyze the feedback, suggestions, and current code, then provide the improved full code wrapped in <code> tags. Do not use to any external files unless explicitly told to do so by the user."
         self.code_improver.set_system_message(system_message)
@@ -209,9 +237,7 @@ class CoderTeam:
             self.code_improver, improvement_prompt
         )
 
-        improved_code = (
-            improved_code_response.split("<code>")[1].split("</code>")[0].strip()
-        )
+        improved_code = extract_tagged(improved_code_response, "code")
         with open(file_path, "w") as f:
             f.write(improved_code)
         print(colored(f"Improved code written to {file_path}", "green"))
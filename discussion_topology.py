@@ -0,0 +1,67 @@
+class DiscussionTopology:
+    """Splits a discussion round into waves whose members speak concurrently."""
+
+    # A member sees the previous rounds plus the responses of earlier waves in the
+    # current round, never those of its own wave.
+    name = "custom"
+
+    def waves(self, members):
+        raise NotImplementedError
+
+
+class SequentialTopology(DiscussionTopology):
+    name = "sequential"
+
+    def waves(self, members):
+        return [[member] for member in members]
+
+
+class ParallelTopology(DiscussionTopology):
+    name = "parallel"
+
+    def waves(self, members):
+        return [list(members)] if members else []
+
+
+class WaveTopology(DiscussionTopology):
+    def __init__(self, leading, name="waves"):
+        # leading is a list of waves, each a list of member names or roles; members
+        # that are not listed speak together in a final wave.
+        self.leading = [list(wave) for wave in leading]
+        self.name = name
+
+    def waves(self, members):
+        waves, placed = [], set()
+        for keys in self.leading:
+            wave = [
+                member
+                for member in members
+                if id(member) not in placed
+                and (member.name in keys or member.role in keys)
+            ]
+            placed.update(id(member) for member in wave)
+            if wave:
+                waves.append(wave)
+        rest = [member for member in members if id(member) not in placed]
+        if rest:
+            waves.append(rest)
+        return waves
+
+
+TOPOLOGIES = {
+    "sequential": SequentialTopology,
+    "parallel": ParallelTopology,
+    "architect-first": lambda: WaveTopology(
+        [["Software Architect"]], name="architect-first"
+    ),
+}
+
+
+def get_topology(topology):
+    if isinstance(topology, DiscussionTopology):
+        return topology
+    if topology not in TOPOLOGIES:
+        raise ValueError(
+            f"Unknown discussion topology {topology!r}; expected one of {', '.join(TOPOLOGIES)}"
+        )
+    return TOPOLOGIES[topology]()
@@ -0,0 +1,33 @@
+class DiscussionTranscript:
+    """Plain-text record of a discussion that remembers which turns each member has been sent."""
+
+    def __init__(self):
+        self.turns = []
+        self._sent = {}
+
+    def __len__(self):
+        return len(self.turns)
+
+    def add(self, speaker, text):
+        self.turns.append((speaker, text))
+
+    def has_joined(self, member):
+        return id(member) in self._sent
+
+    def forget(self, member):
+        # The member lost its earlier context (e.g. its history was trimmed), so the
+        # next delta starts from the beginning again.
+        self._sent.pop(id(member), None)
+
+    def unseen(self, member, upto=None):
+        # Turns up to `upto` that have not been sent to this member yet, leaving out
+        # its own (already in its history). Members of one wave pass the same `upto`.
+        upto = len(self.turns) if upto is None else upto
+        start = self._sent.get(id(member), 0)
+        self._sent[id(member)] = max(start, upto)
+        return [
+            text for speaker, text in self.turns[start:upto] if speaker is not member
+        ]
+
+    def text(self):
+        return "\n".join(text for _, text in self.turns)
@@ -0,0 +1,268 @@
+import io
+import os
+import sys
+import json
+import time
+import queue
+import select
+import atexit
+import runpy
+import socket
+import threading
+import traceback
+import subprocess
+from importlib import import_module
+from termcolor import colored
+from code_runner import CodeRunner, apply_rlimits
+
+
+# SOCK_SEQPACKET is missing on macOS, where the worker is watched through poll().
+SOCKET_TYPE = getattr(socket, "SOCK_SEQPACKET", socket.SOCK_DGRAM)
+if sys.platform == "darwin":
+    SOCKET_TYPE = socket.SOCK_DGRAM
+# Seconds between checks that the worker is alive while waiting for its reply,
+# and how long it has to report a run after the child was killed.
+POLL_INTERVAL = 0.5
+REPLY_GRACE = 5
+
+
+class ForkServerRunner(CodeRunner):
+    """CodeRunner that forks each run from a warm interpreter with modules already imported."""
+
+    def __init__(self, preload=(), workers=2, **kwargs):
+        super().__init__(**kwargs)
+        # Imported once per worker; each run is a fresh fork of that interpreter.
+        self.preload = list(preload)
+        self.workers = workers
+        self._idle = queue.Queue()
+        self._pool = []
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start_worker(self):
+        # Unlike a datagram pair, a seqpacket pair reads b"" once the worker is gone.
+        ours, theirs = socket.socketpair(socket.AF_UNIX, SOCKET_TYPE)
+        process = subprocess.Popen(
+            [self.python, os.path.abspath(__file__), str(theirs.fileno())]
+            + self.preload,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            env=self._child_env(),
+            pass_fds=(theirs.fileno(),),
+            # Ctrl-C in the terminal stops the pipeline, not the warm workers.
+            start_new_session=True,
+        )
+        theirs.close()
+        return _Worker(process, ours)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._pool) < self.workers:
+                worker = self._start_worker()
+                self._pool.append(worker)
+                return worker
+        return self._idle.get()
+
+    def _release(self, worker, healthy):
+        if healthy:
+            self._idle.put(worker)
+            return
+        worker.close()
+        with self._lock:
+            self._pool.remove(worker)
+
+    def run(self, file_path):
+        if not hasattr(os, "fork"):
+            return super().run(file_path)
+        worker = self._acquire()
+        healthy = False
+        try:
+            result = self._run_in(worker, file_path)
+            healthy = True
+            return result
+        except (OSError, ValueError, KeyError) as e:
+            print(
+                colored(
+                    f"Fork server worker failed ({e}); running in a new interpreter",
+                    "red",
+                )
+            )
+            return super().run(file_path)
+        finally:
+            self._release(worker, healthy)
+
+    def _run_in(self, worker, file_path):
+        started = time.monotonic()
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        try:
+            worker.send(
+                {
+                    "path": os.path.abspath(file_path),
+                    "cwd": os.getcwd(),
+                    "rlimits": self._rlimits(),
+                },
+                [stdout_write, stderr_write],
+            )
+        except OSError:
+            for fd in (stdout_read, stdout_write, stderr_read, stderr_write):
+                os.close(fd)
+            raise
+        os.close(stdout_write)
+        os.close(stderr_write)
+        stdout = open(stdout_read, "rb")
+        stderr = open(stderr_read, "rb")
+        try:
+            pid = worker.receive()["pid"]
+        except (OSError, ValueError, KeyError):
+            stdout.close()
+            stderr.close()
+            raise
+        return self._supervise(pid, stdout, stderr, started, process=worker)
+
+    def _wait(self, pid, worker):
+        if not isinstance(worker, _Worker):
+            # Fallback run in a new interpreter.
+            return super()._wait(pid, worker)
+        # The child belongs to the worker, which reaps it and reports how it ended.
+        reply = worker.receive()
+        return reply["exit_code"], reply["peak_rss"], reply["cpu_seconds"]
+
+    def _kill(self, pid, worker=None):
+        super()._kill(pid, worker)
+        if isinstance(worker, _Worker):
+            # The child is gone, so the worker's report is due; one that does not
+            # come in time ends the wait instead of blocking the run.
+            worker.expect_reply(REPLY_GRACE)
+
+    def close(self):
+        with self._lock:
+            workers, self._pool = self._pool, []
+        for worker in workers:
+            worker.close()
+
+
+class _Worker:
+    def __init__(self, process, sock):
+        self.process = process
+        self.sock = sock
+        self.deadline = None
+
+    def send(self, message, fds=()):
+        self.deadline = None
+        socket.send_fds(self.sock, [json.dumps(message).encode()], list(fds))
+
+    def expect_reply(self, seconds):
+        if self.deadline is None:
+            self.deadline = time.monotonic() + seconds
+
+    def receive(self):
+        while not select.select([self.sock], [], [], POLL_INTERVAL)[0]:
+            # Also covers a datagram pair, which never reads b"" for a dead peer.
+            if self.process.poll() is not None:
+                raise OSError("fork server worker exited")
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                self.sock.close()
+                raise OSError("fork server worker stopped responding")
+        data = self.sock.recv(65536)
+        if not data:
+            raise OSError("fork server worker exited")
+        return json.loads(data)
+
+    def close(self):
+        # The worker exits when its socket closes.
+        self.sock.close()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def _serve(sock, preload):
+    for name in preload:
+        try:
+            import_module(name)
+        except Exception as e:
+            print(f"fork server: could not preload {name}: {e}", file=sys.stderr)
+    scale = 1 if sys.platform == "darwin" else 1024
+    while True:
+        try:
+            data, fds, _, _ = socket.recv_fds(sock, 65536, 2)
+        except OSError:
+            return
+        if not data:
+            return
+        request = json.loads(data)
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            _run_child(request, fds)
+        for fd in fds:
+            os.close(fd)
+        sock.send(json.dumps({"pid": pid}).encode())
+        _, status, usage = os.wait4(pid, 0)
+        sock.send(
+            json.dumps(
+                {
+                    "exit_code": os.waitstatus_to_exitcode(status),
+                    "peak_rss": usage.ru_maxrss * scale,
+                    "cpu_seconds": usage.ru_utime + usage.ru_stime,
+                }
+            ).encode()
+        )
+
+
+def _run_child(request, fds):
+    # Does what `python path` would do, in a fork of the warm interpreter.
+    code = 1
+    try:
+        os.setsid()
+        for target, fd in zip((1, 2), fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, 0)
+        os.close(null)
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = io.TextIOWrapper(
+            io.FileIO(1, "w", closefd=False), write_through=True
+        )
+        sys.stderr = io.TextIOWrapper(
+            io.FileIO(2, "w", closefd=False), write_through=True
+        )
+        apply_rlimits(*request["rlimits"])
+        path = request["path"]
+        os.chdir(request["cwd"])
+        sys.argv = [path]
+        sys.path[0] = os.path.dirname(path)
+        try:
+            runpy.run_path(path, run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                code = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+        except BaseException as e:
+            # Leave out the runpy frames, like a traceback from `python path`.
+            tb = e.__traceback__
+            while tb is not None and tb.tb_frame.f_code.co_filename != path:
+                tb = tb.tb_next
+            traceback.print_exception(type(e), e, tb)
+        for thread in threading.enumerate():
+            if thread is not threading.main_thread() and not thread.daemon:
+                thread.join()
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(code)
+
+
+if __name__ == "__main__":
+    _serve(socket.socket(fileno=int(sys.argv[1])), sys.argv[2:])
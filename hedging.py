@@ -0,0 +1,270 @@
+import time
+import socket
+import asyncio
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from retry_policy import RetryPolicy
+
+
+class LegCancelled(BaseException):
+    # A BaseException, like asyncio.CancelledError, so the losing leg's retry loop
+    # does not catch it and send the request again.
+    pass
+
+
+class HedgeLeg:
+    """Open responses of one sync hedge leg, so another thread can cancel it."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._responses = []
+        self._lock = threading.Lock()
+
+    def track(self, response):
+        with self._lock:
+            if not self.cancelled:
+                self._responses.append(response)
+                return
+        response.close()
+        raise LegCancelled()
+
+    def check(self):
+        if self.cancelled:
+            raise LegCancelled()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            responses, self._responses = self._responses, []
+        for response in responses:
+            _interrupt(response)
+
+
+def _interrupt(response):
+    # Closing a socket does not wake a thread blocked reading it; shutting it down
+    # does, and the leg then fails and closes its own stream.
+    http_response = getattr(response, "response", response)
+    extensions = getattr(http_response, "extensions", None) or {}
+    network_stream = extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream else None
+    try:
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+        else:
+            response.close()
+    except Exception:
+        pass
+
+
+class HedgePolicy:
+    """Decides when to send a backup request to a secondary provider and when to fail over to it."""
+
+    def __init__(
+        self,
+        provider,
+        model=None,
+        percentile=0.9,
+        initial_delay=2.0,
+        min_delay=0.25,
+        max_delay=30.0,
+        min_samples=10,
+        window=200,
+        failover_after=3,
+        failover_cooldown=60.0,
+        retry_policy: RetryPolicy = None,
+    ):
+        self.provider = provider.lower()
+        self.model = model
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.failover_after = failover_after
+        self.failover_cooldown = failover_cooldown
+        # Each leg gives up quickly because the other provider is there to cover for it;
+        # no attempt of a leg outlives this deadline (see RetryPolicy.request_timeout).
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=2, deadline=60.0)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._errors = defaultdict(int)
+        self._failed_over_until = {}
+        self._lock = threading.Lock()
+
+    def hedge_delay(self, key):
+        with self._lock:
+            samples = sorted(self._samples[key])
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        delay = samples[min(len(samples) - 1, int(len(samples) * self.percentile))]
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def record_first_token(self, key, seconds):
+        with self._lock:
+            self._samples[key].append(seconds)
+
+    def record_success(self, key):
+        with self._lock:
+            self._errors[key] = 0
+
+    def record_error(self, key):
+        with self._lock:
+            self._errors[key] += 1
+            if self._errors[key] >= self.failover_after:
+                self._errors[key] = 0
+                self._failed_over_until[key] = time.monotonic() + self.failover_cooldown
+                self.failovers += 1
+
+    def failed_over(self, key):
+        with self._lock:
+            return time.monotonic() < self._failed_over_until.get(key, 0)
+
+    def _count_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def _count_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+            }
+
+
+def _settle(policy, legs, started, failed, winner):
+    now = time.monotonic()
+    for index, start in started.items():
+        # A loser's elapsed time is a lower bound on its time to first token.
+        if index not in failed:
+            policy.record_first_token(legs[index][0], now - start)
+    policy.record_success(legs[winner][0])
+    if winner:
+        policy._count_win()
+
+
+def hedged_stream(legs, policy):
+    # legs is [(key, start, cancel)], primary first; start() returns a StreamChunk
+    # generator. The first leg to produce a chunk wins and the others are cancelled.
+    executor = ThreadPoolExecutor(max_workers=len(legs))
+    streams, pending, started = {}, {}, {}
+
+    def launch(index):
+        streams[index] = legs[index][1]()
+        started[index] = time.monotonic()
+        pending[executor.submit(next, streams[index], None)] = index
+
+    launch(0)
+    delay = policy.hedge_delay(legs[0][0])
+    winner = first = error = None
+    failed = set()
+    try:
+        while winner is None:
+            timeout = None
+            if len(started) < len(legs):
+                timeout = max(0.0, started[0] + delay - time.monotonic())
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                policy._count_hedge()
+                launch(len(started))
+                continue
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    chunk = future.result()
+                except Exception as e:
+                    error = e
+                    failed.add(index)
+                    policy.record_error(legs[index][0])
+                    continue
+                if winner is None:
+                    winner, first = index, chunk
+                else:
+                    streams[index].close()
+            if winner is None and not pending:
+                if len(started) == len(legs):
+                    raise error
+                launch(len(started))
+    finally:
+        # Losers still waiting on their first chunk are cancelled now, which unblocks
+        # their threads; their generators are closed once the pending read returns.
+        for future, index in pending.items():
+            legs[index][2]()
+            future.add_done_callback(lambda _, stream=streams[index]: stream.close())
+        executor.shutdown(wait=False)
+
+    _settle(policy, legs, started, failed, winner)
+    if first is not None:
+        yield first
+    yield from streams[winner]
+
+
+async def _next_chunk(stream):
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def hedged_stream_async(legs, policy):
+    streams, pending, started = {}, {}, {}
+
+    def launch(index):
+        streams[index] = legs[index][1]()
+        started[index] = time.monotonic()
+        pending[asyncio.ensure_future(_next_chunk(streams[index]))] = index
+
+    launch(0)
+    delay = policy.hedge_delay(legs[0][0])
+    winner = first = error = None
+    failed = set()
+    losers = []
+    try:
+        while winner is None:
+            timeout = None
+            if len(started) < len(legs):
+                timeout = max(0.0, started[0] + delay - time.monotonic())
+            done, _ = await asyncio.wait(
+                list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                policy._count_hedge()
+                launch(len(started))
+                continue
+            for task in done:
+                index = pending.pop(task)
+                try:
+                    chunk = task.result()
+                except Exception as e:
+                    error = e
+                    failed.add(index)
+                    policy.record_error(legs[index][0])
+                    continue
+                if winner is None:
+                    winner, first = index, chunk
+                else:
+                    losers.append(index)
+            if winner is None and not pending:
+                if len(started) == len(legs):
+                    raise error
+                launch(len(started))
+    finally:
+        for task, index in pending.items():
+            task.cancel()
+            losers.append(index)
+        await asyncio.gather(*pending, return_exceptions=True)
+        for index in losers:
+            await streams[index].aclose()
+
+    _settle(policy, legs, started, failed, winner)
+    if first is not None:
+        yield first
+    async for chunk in streams[winner]:
+        yield chunk
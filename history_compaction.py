@@ -0,0 +1,188 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from termcolor import colored
+from message_history import content_text
+
+
+SUMMARY_MODELS = {
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-haiku-20240307",
+    "openrouter": "google/gemini-flash-1.5",
+    "local": "local-model",
+}
+
+SUMMARY_SYSTEM_MESSAGE = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Fold the new messages into the existing summary. Keep every requirement, decision, "
+    "constraint, file name and open question; drop pleasantries and repeated detail. "
+    "Reply with the updated summary only."
+)
+
+
+class HistoryCompactor:
+    """Folds the oldest turns of a history into a running summary written by a cheaper model."""
+
+    def __init__(
+        self,
+        provider=None,
+        model=None,
+        compact_at=0.75,
+        keep_ratio=0.5,
+        min_recent_messages=4,
+        summary_max_words=600,
+        summarizer=None,
+    ):
+        if not 0 < keep_ratio < compact_at <= 1:
+            raise ValueError("Expected 0 < keep_ratio < compact_at <= 1")
+        self.provider = provider
+        self.model = model
+        self.compact_at = compact_at
+        self.keep_ratio = keep_ratio
+        self.min_recent_messages = min_recent_messages
+        self.summary_max_words = summary_max_words
+        self.summarizer = summarizer
+        self.summary = ""
+        self.compactions = 0
+        self._folding = None
+        self._ready = None
+        self._future = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="history-compaction"
+        )
+
+    def copy(self):
+        return HistoryCompactor(
+            provider=self.provider,
+            model=self.model,
+            compact_at=self.compact_at,
+            keep_ratio=self.keep_ratio,
+            min_recent_messages=self.min_recent_messages,
+            summary_max_words=self.summary_max_words,
+            summarizer=self.summarizer,
+        )
+
+    def _summary_agent(self, agent):
+        # Imported here because unified.py imports this module.
+        from unified import UnifiedApis
+
+        provider = self.provider or agent.provider
+        return UnifiedApis(
+            name=f"{agent.name} Summarizer",
+            provider=provider,
+            model=self.model or SUMMARY_MODELS.get(provider),
+            stream=False,
+            should_print_init=False,
+            max_history_words=None,
+            retry_policy=agent.retry_policy,
+            telemetry=agent.telemetry,
+            budget=agent.budget,
+        )
+
+    def _prompt(self, previous_summary, messages):
+        transcript = "\n\n".join(
+            f"{message['role']}: {content_text(message['content'])}"
+            for message in messages
+        )
+        return (
+            f"Existing summary:\n{previous_summary or '(none yet)'}\n\n"
+            f"New messages:\n{transcript}\n\n"
+            f"Write the updated summary in {self.summary_max_words} words or less."
+        )
+
+    def _summarize(self, agent, previous_summary, messages):
+        if self.summarizer is not None:
+            return self.summarizer(previous_summary, messages)
+        summary_agent = self._summary_agent(agent)
+        summary_agent.set_system_message(SUMMARY_SYSTEM_MESSAGE)
+        return summary_agent.chat(
+            self._prompt(previous_summary, messages), should_print=False
+        )
+
+    def _over(self, history, max_words, max_tokens, ratio):
+        return (max_words is not None and history.total_words > max_words * ratio) or (
+            max_tokens is not None and history.total_tokens > max_tokens * ratio
+        )
+
+    def _oldest_turns(self, history, max_words, max_tokens):
+        # The oldest messages that have to go for the rest to fit in keep_ratio of the budget.
+        words, tokens = history.total_words, history.total_tokens
+        sizes = history.sizes()
+        count = 0
+        while len(history) - count > self.min_recent_messages and (
+            (max_words is not None and words > max_words * self.keep_ratio)
+            or (max_tokens is not None and tokens > max_tokens * self.keep_ratio)
+        ):
+            words -= sizes[count][0]
+            tokens -= sizes[count][1]
+            count += 1
+        return history[:count]
+
+    def _run(self, generation, agent, previous_summary, messages):
+        try:
+            summary = self._summarize(agent, previous_summary, messages)
+        except Exception as e:
+            print(colored(f"History compaction failed: {e}", "red"))
+            summary = None
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._folding = None
+            if summary:
+                self._ready = (summary, messages)
+
+    def _apply(self, history):
+        with self._lock:
+            ready, self._ready = self._ready, None
+        if ready is None:
+            return
+        summary, messages = ready
+        folded = {id(message) for message in messages}
+        while history and id(history[0]) in folded:
+            history.popleft()
+        self.summary = summary
+        self.compactions += 1
+
+    def compact(self, agent):
+        # Called from trim_history: swaps in a finished summary, then starts the next
+        # fold in the background once the history crosses compact_at of its budget.
+        history = agent.history
+        self._apply(history)
+        max_words, max_tokens = agent.max_history_words, agent.max_history_tokens
+        with self._lock:
+            if self._folding is not None or self._ready is not None:
+                return
+            if not self._over(history, max_words, max_tokens, self.compact_at):
+                return
+            messages = self._oldest_turns(history, max_words, max_tokens)
+            if not messages:
+                return
+            self._folding = messages
+            generation = self._generation
+            previous_summary = self.summary
+        self._future = self._executor.submit(
+            self._run, generation, agent, previous_summary, messages
+        )
+
+    def wait(self, history=None):
+        future = self._future
+        if future is not None:
+            future.result()
+        if history is not None:
+            self._apply(history)
+
+    def reset(self):
+        with self._lock:
+            self._generation += 1
+            self._folding = None
+            self._ready = None
+        self.summary = ""
+
+    def system_prompt(self, system_message):
+        if not self.summary:
+            return system_message
+        return (
+            f"{content_text(system_message)}\n\n"
+            f"Summary of the earlier conversation:\n{self.summary}"
+        )
@@ -0,0 +1,128 @@
+import json
+import bisect
+
+
+class IncrementalJSONParser:
+    """Reports each value of a streamed JSON document as soon as it is complete."""
+
+    def __init__(self, max_depth=2):
+        self.max_depth = max_depth
+        self.done = False
+        self.value = None
+        # Fed text is kept as chunks with their start offsets and only joined when
+        # a value completes, so feeding stays linear in the reply length.
+        self._chunks = []
+        self._offsets = []
+        self._length = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._scalar_start = None
+
+    @property
+    def text(self):
+        return "".join(self._chunks)
+
+    @property
+    def incomplete(self):
+        # True once JSON has started but the root value has not closed yet.
+        return not self.done and (bool(self._stack) or self._scalar_start is not None)
+
+    def feed(self, text):
+        # Returns (path, value) pairs, e.g. (("steps", 0), {...}), for values at most
+        # max_depth deep. Text before the first { or [ is skipped.
+        events = []
+        if not text or self.done:
+            return events
+        offset = self._length
+        self._chunks.append(text)
+        self._offsets.append(offset)
+        self._length += len(text)
+        for i, char in enumerate(text, offset):
+            if self.done:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._end_string(i + 1, events)
+                continue
+            if not self._stack:
+                if char in "{[":
+                    self._push(char, i)
+                continue
+            frame = self._stack[-1]
+            if char in " \t\r\n":
+                self._end_scalar(i, events)
+            elif char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char in "{[":
+                self._push(char, i)
+            elif char in "}]":
+                self._end_scalar(i, events)
+                self._stack.pop()
+                self._complete(frame["start"], i + 1, events)
+            elif char == ":":
+                frame["expect_key"] = False
+            elif char == ",":
+                self._end_scalar(i, events)
+                frame["expect_key"] = frame["kind"] == "{"
+            elif self._scalar_start is None:
+                self._scalar_start = i
+        return events
+
+    def _slice(self, start, end):
+        first = bisect.bisect_right(self._offsets, start) - 1
+        last = bisect.bisect_left(self._offsets, end)
+        base = self._offsets[first]
+        return "".join(self._chunks[first:last])[start - base : end - base]
+
+    def _push(self, kind, start):
+        if self._stack:
+            parent = self._stack[-1]
+            path = parent["path"] + (self._slot(parent),)
+        else:
+            path = ()
+        self._stack.append(
+            {
+                "kind": kind,
+                "start": start,
+                "path": path,
+                "key": None,
+                "index": 0,
+                "expect_key": kind == "{",
+            }
+        )
+
+    @staticmethod
+    def _slot(frame):
+        return frame["key"] if frame["kind"] == "{" else frame["index"]
+
+    def _end_string(self, end, events):
+        frame = self._stack[-1]
+        if frame["kind"] == "{" and frame["expect_key"]:
+            frame["key"] = json.loads(self._slice(self._string_start, end))
+        else:
+            self._complete(self._string_start, end, events)
+
+    def _end_scalar(self, end, events):
+        if self._scalar_start is not None:
+            start, self._scalar_start = self._scalar_start, None
+            self._complete(start, end, events)
+
+    def _complete(self, start, end, events):
+        if not self._stack:
+            self.value = json.loads(self._slice(start, end))
+            self.done = True
+            return
+        frame = self._stack[-1]
+        path = frame["path"] + (self._slot(frame),)
+        if frame["kind"] == "[":
+            frame["index"] += 1
+        if len(path) <= self.max_depth:
+            events.append((path, json.loads(self._slice(start, end))))
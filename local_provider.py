@@ -0,0 +1,668 @@
+import os
+import sys
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import deque
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_CODE = 'print("Hello from the local provider")'
+
+
+class LocalProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (cancelled hedges, closed streams) is expected.
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class LocalProvider:
+    """In-process HTTP stand-in that speaks the OpenAI and Anthropic wire formats."""
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        time_to_first_token=0.0,
+        tokens_per_second=None,
+        reply_words=200,
+        replies=None,
+        reply_fn=None,
+        recording=None,
+        error_rate=0.0,
+        error_status=429,
+        retry_after=None,
+        drop_stream_after=None,
+        seed=None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.time_to_first_token = time_to_first_token
+        self.tokens_per_second = tokens_per_second
+        self.reply_words = reply_words
+        self.replies = list(replies or [])
+        self.reply_fn = reply_fn
+        self.recorded = {}
+        if recording:
+            self.load_recording(recording)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        # Streams end after this many tokens with no finish event, like a dropped
+        # connection.
+        self.drop_stream_after = drop_stream_after
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.error_count = 0
+        self.requests = []
+        self.files = {}
+        self.batches = {}
+        self._reply_index = 0
+        # Replies that went out cut short, so a continuation request can be answered
+        # with the rest.
+        self._cut_replies = deque(maxlen=64)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def openai_base_url(self):
+        return f"{self.base_url}/v1"
+
+    def load_recording(self, path):
+        # JSONL lines of {"prompt": <last user message>, "reply": <assistant text>}.
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    self.recorded[entry["prompt"]] = entry["reply"]
+
+    def start(self):
+        provider = self
+
+        class Handler(LocalProviderHandler):
+            local_provider = provider
+
+        self._server = LocalProviderServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def route_all(self):
+        # Point every provider at this server; affects UnifiedApis instances created afterwards.
+        os.environ["OPENAI_BASE_URL"] = self.openai_base_url
+        os.environ["OPENROUTER_BASE_URL"] = self.openai_base_url
+        os.environ["ANTHROPIC_BASE_URL"] = self.base_url
+        os.environ["LOCAL_API_BASE_URL"] = self.openai_base_url
+        for name in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "OPENROUTER_API_KEY"):
+            os.environ[name] = "local"
+
+    def should_fail(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            with self._lock:
+                self.error_count += 1
+            return True
+        return False
+
+    def reply_for(self, wire_format, body):
+        messages = body.get("messages", [])
+        partial = continued_text(messages)
+        with self._lock:
+            self.request_count += 1
+            self.requests.append({"format": wire_format, "body": body})
+            if partial:
+                for reply in reversed(self._cut_replies):
+                    if len(reply) > len(partial) and reply.startswith(partial):
+                        return reply[len(partial) :]
+            reply = self._next_reply(last_user_text(messages), body)
+            if self._is_cut(body, reply):
+                self._cut_replies.append(reply)
+            return reply
+
+    def _next_reply(self, prompt, body):
+        if self.reply_fn:
+            return self.reply_fn(body)
+        if prompt in self.recorded:
+            return self.recorded[prompt]
+        if self.replies:
+            reply = self.replies[self._reply_index % len(self.replies)]
+            self._reply_index += 1
+            return reply
+        words = " ".join(f"word{i}" for i in range(self.reply_words))
+        return f"Local reply. {words}\n<code>\n{DEFAULT_CODE}\n</code>"
+
+    def _is_cut(self, body, reply):
+        tokens, truncated = limit_tokens(body, reply)
+        dropped = (
+            body.get("stream")
+            and self.drop_stream_after is not None
+            and len(tokens) > self.drop_stream_after
+        )
+        return truncated or dropped
+
+
+def last_user_text(messages):
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content")
+            if isinstance(content, list):
+                return "".join(block.get("text", "") for block in content)
+            return str(content)
+    return ""
+
+
+def continued_text(messages):
+    # A continuation request ends with the cut-off assistant reply followed by a user
+    # message asking to continue it.
+    if (
+        len(messages) >= 2
+        and messages[-1].get("role") == "user"
+        and messages[-2].get("role") == "assistant"
+    ):
+        content = messages[-2].get("content")
+        if isinstance(content, list):
+            return "".join(block.get("text", "") for block in content)
+        return content
+    return None
+
+
+def estimate_tokens(value):
+    return max(1, len(json.dumps(value)) // 4)
+
+
+def split_tokens(text):
+    return re.findall(r"\s*\S+\s*", text) or [text]
+
+
+def limit_tokens(body, reply):
+    # Cuts the reply off at the request's max_tokens, as the real APIs do.
+    tokens = split_tokens(reply)
+    limit = body.get("max_tokens")
+    if limit and len(tokens) > limit:
+        return tokens[:limit], True
+    return tokens, False
+
+
+class LocalProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; Nagle would delay the second by ~40ms.
+    disable_nagle_algorithm = True
+    local_provider = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        path = self.path.split("?")[0]
+        if path.endswith("/files"):
+            self._send_json(200, self._create_file(raw))
+            return
+        body = json.loads(raw or b"{}")
+        if path.endswith("/messages/batches"):
+            self._send_json(200, self._create_anthropic_batch(body))
+            return
+        if path.endswith("/batches"):
+            self._send_json(200, self._create_openai_batch(body))
+            return
+        if path.endswith("/chat/completions"):
+            wire_format = "openai"
+        elif path.endswith("/messages"):
+            wire_format = "anthropic"
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {path}"}})
+            return
+
+        provider = self.local_provider
+        if provider.latency:
+            time.sleep(provider.latency)
+        if provider.should_fail():
+            self._send_error(wire_format)
+            return
+
+        reply = provider.reply_for(wire_format, body)
+        if body.get("stream"):
+            self._stream(wire_format, body, reply)
+        elif wire_format == "openai":
+            self._send_json(200, openai_completion(body, reply))
+        else:
+            self._send_json(200, anthropic_message(body, reply))
+
+    def do_GET(self):
+        provider = self.local_provider
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[-1] == "content" and parts[-3] == "files":
+            self._send_text(provider.files[parts[-2]])
+        elif parts[-1] == "results" and parts[-3] == "batches":
+            self._send_text(provider.batches[parts[-2]]["results"])
+        elif parts[-2] == "batches":
+            batch = dict(provider.batches[parts[-1]])
+            batch.pop("results", None)
+            self._send_json(200, batch)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    # Batches are processed synchronously on creation, so the first poll sees them finished.
+    def _create_file(self, raw):
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + raw
+        )
+        content = b""
+        filename = "upload"
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                content = part.get_payload(decode=True)
+                filename = part.get_filename() or filename
+        return self._store_file(content.decode("utf-8"), filename)
+
+    def _store_file(self, text, filename):
+        file_id = f"file-{uuid.uuid4().hex}"
+        self.local_provider.files[file_id] = text
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(text),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": "batch",
+            "status": "processed",
+        }
+
+    def _create_openai_batch(self, body):
+        provider = self.local_provider
+        output = []
+        for line in provider.files[body["input_file_id"]].splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            reply = provider.reply_for("openai", entry["body"])
+            output.append(
+                json.dumps(
+                    {
+                        "id": f"batch_req_{uuid.uuid4().hex}",
+                        "custom_id": entry["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "body": openai_completion(entry["body"], reply),
+                        },
+                        "error": None,
+                    }
+                )
+            )
+        output_file = self._store_file("\n".join(output), "output.jsonl")
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        provider.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"],
+            "status": "completed",
+            "output_file_id": output_file["id"],
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {
+                "total": len(output),
+                "completed": len(output),
+                "failed": 0,
+            },
+        }
+        return provider.batches[batch_id]
+
+    def _create_anthropic_batch(self, body):
+        provider = self.local_provider
+        results = []
+        for request in body["requests"]:
+            reply = provider.reply_for("anthropic", request["params"])
+            results.append(
+                json.dumps(
+                    {
+                        "custom_id": request["custom_id"],
+                        "result": {
+                            "type": "succeeded",
+                            "message": anthropic_message(request["params"], reply),
+                        },
+                    }
+                )
+            )
+        batch_id = f"msgbatch_{uuid.uuid4().hex}"
+        provider.batches[batch_id] = {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended",
+            "request_counts": {"succeeded": len(results)},
+            "results_url": f"{provider.base_url}/v1/messages/batches/{batch_id}/results",
+            "results": "\n".join(results),
+        }
+        batch = dict(provider.batches[batch_id])
+        batch.pop("results")
+        return batch
+
+    def _send_text(self, text):
+        data = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, wire_format):
+        provider = self.local_provider
+        message = "Injected error from local provider"
+        headers = {}
+        if provider.retry_after is not None:
+            headers["retry-after"] = str(provider.retry_after)
+        if wire_format == "openai":
+            payload = {"error": {"message": message, "type": "rate_limit_error"}}
+        else:
+            payload = {
+                "type": "error",
+                "error": {"type": "rate_limit_error", "message": message},
+            }
+        self._send_json(provider.error_status, payload, headers)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, wire_format, body, reply):
+        provider = self.local_provider
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if provider.time_to_first_token:
+            time.sleep(provider.time_to_first_token)
+        interval = 1.0 / provider.tokens_per_second if provider.tokens_per_second else 0
+        if wire_format == "openai":
+            events = openai_stream_events(body, reply)
+        else:
+            events = anthropic_stream_events(body, reply)
+        sent = 0
+        for event, is_token in events:
+            if is_token and sent == provider.drop_stream_after:
+                break
+            self._write_chunk(event.encode("utf-8"))
+            if is_token:
+                sent += 1
+                if interval:
+                    time.sleep(interval)
+        self._write_chunk(b"")
+
+
+def sample_from_schema(schema, text, defs=None):
+    # Smallest value matching a JSON schema, with every string set to the reply text.
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return sample_from_schema(defs[schema["$ref"].split("/")[-1]], text, defs)
+    if "anyOf" in schema:
+        return sample_from_schema(schema["anyOf"][0], text, defs)
+    kind = schema.get("type")
+    if kind == "object" or "properties" in schema:
+        return {
+            name: sample_from_schema(prop, text, defs)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return []
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    if kind == "null":
+        return None
+    return text
+
+
+def structured_reply(reply, schema):
+    # A reply that is already a JSON object is passed through as-is, valid or not.
+    try:
+        value = json.loads(reply)
+        if isinstance(value, dict):
+            return value
+    except ValueError:
+        pass
+    return sample_from_schema(schema, reply)
+
+
+def forced_tool(body):
+    choice = body.get("tool_choice")
+    if not isinstance(choice, dict):
+        return None, None
+    name = choice.get("name") or (choice.get("function") or {}).get("name")
+    for tool in body.get("tools") or []:
+        spec = tool.get("function", tool)
+        if spec.get("name") == name:
+            return name, spec.get("input_schema") or spec.get("parameters") or {}
+    return None, None
+
+
+def openai_completion(body, reply):
+    tokens, truncated = limit_tokens(body, reply)
+    prompt_tokens = estimate_tokens(body.get("messages", []))
+    message = {"role": "assistant", "content": "".join(tokens)}
+    finish_reason = "length" if truncated else "stop"
+    tool_name, schema = forced_tool(body)
+    response_format = body.get("response_format") or {}
+    if tool_name:
+        arguments = json.dumps(structured_reply(reply, schema))
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": f"call_{uuid.uuid4().hex}",
+                    "type": "function",
+                    "function": {"name": tool_name, "arguments": arguments},
+                }
+            ],
+        }
+        finish_reason = "tool_calls"
+    elif response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"].get("schema", {})
+        message["content"] = json.dumps(structured_reply(reply, schema))
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "local-model"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        },
+    }
+
+
+def openai_stream_events(body, reply):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model", "local-model")
+
+    def chunk(delta, finish_reason=None, **extra):
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": (
+                [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+                if delta is not None
+                else []
+            ),
+        }
+        payload.update(extra)
+        return f"data: {json.dumps(payload)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""}), False
+    tokens, truncated = limit_tokens(body, reply)
+    for token in tokens:
+        yield chunk({"content": token}), True
+    yield chunk({}, "length" if truncated else "stop"), False
+    if (body.get("stream_options") or {}).get("include_usage"):
+        prompt_tokens = estimate_tokens(body.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        yield chunk(None, usage=usage), False
+    yield "data: [DONE]\n\n", False
+
+
+def anthropic_usage(body, output_tokens):
+    return {
+        "input_tokens": estimate_tokens(
+            [body.get("system", ""), body.get("messages", [])]
+        ),
+        "output_tokens": output_tokens,
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": 0,
+    }
+
+
+def anthropic_message(body, reply):
+    tokens, truncated = limit_tokens(body, reply)
+    content = [{"type": "text", "text": "".join(tokens)}]
+    stop_reason = "max_tokens" if truncated else "end_turn"
+    tool_name, schema = forced_tool(body)
+    if tool_name:
+        content = [
+            {
+                "type": "tool_use",
+                "id": f"toolu_{uuid.uuid4().hex}",
+                "name": tool_name,
+                "input": structured_reply(reply, schema),
+            }
+        ]
+        stop_reason = "tool_use"
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "local-model"),
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": anthropic_usage(body, len(tokens)),
+    }
+
+
+def anthropic_stream_events(body, reply):
+    def event(name, payload):
+        return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+    message = anthropic_message(body, "")
+    message["content"] = []
+    message["stop_reason"] = None
+    message["usage"]["output_tokens"] = 1
+    yield event("message_start", {"type": "message_start", "message": message}), False
+    yield event(
+        "content_block_start",
+        {
+            "type": "content_block_start",
+            "index": 0,
+            "content_block": {"type": "text", "text": ""},
+        },
+    ), False
+    tokens, truncated = limit_tokens(body, reply)
+    for token in tokens:
+        yield event(
+            "content_block_delta",
+            {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": token},
+            },
+        ), True
+    yield event("content_block_stop", {"type": "content_block_stop", "index": 0}), False
+    yield event(
+        "message_delta",
+        {
+            "type": "message_delta",
+            "delta": {
+                "stop_reason": "max_tokens" if truncated else "end_turn",
+                "stop_sequence": None,
+            },
+            "usage": {"output_tokens": len(tokens)},
+        },
+    ), False
+    yield event("message_stop", {"type": "message_stop"}), False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a local stand-in for the OpenAI and Anthropic APIs."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--ttft", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=None)
+    parser.add_argument("--reply-words", type=int, default=200)
+    parser.add_argument("--recording", default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    args = parser.parse_args()
+
+    server = LocalProvider(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        time_to_first_token=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        reply_words=args.reply_words,
+        recording=args.recording,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    ).start()
+    print(f"Local provider listening on {server.base_url}")
+    print(f"  OPENAI_BASE_URL={server.openai_base_url}")
+    print(f"  OPENROUTER_BASE_URL={server.openai_base_url}")
+    print(f"  ANTHROPIC_BASE_URL={server.base_url}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,115 @@
+from collections import deque
+
+
+def content_text(content):
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content)
+    if isinstance(content, dict):
+        return content.get("text", "")
+    return str(content)
+
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English prose and code.
+    return (len(text) + 3) // 4
+
+
+class MessageHistory:
+    """List-like conversation history that measures each message once and keeps running totals."""
+
+    def __init__(self, messages=None, token_counter=None):
+        self.token_counter = token_counter or estimate_tokens
+        self._messages = deque()
+        self._sizes = deque()
+        self.total_words = 0
+        self.total_tokens = 0
+        for message in messages or []:
+            self.append(message)
+
+    def _measure(self, message):
+        if message["role"] == "system":
+            return 0, 0
+        text = content_text(message["content"])
+        return len(text.split()), self.token_counter(text)
+
+    def append(self, message):
+        words, tokens = self._measure(message)
+        self._messages.append(message)
+        self._sizes.append((words, tokens))
+        self.total_words += words
+        self.total_tokens += tokens
+
+    def insert(self, index, message):
+        words, tokens = self._measure(message)
+        self._messages.insert(index, message)
+        self._sizes.insert(index, (words, tokens))
+        self.total_words += words
+        self.total_tokens += tokens
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def popleft(self):
+        words, tokens = self._sizes.popleft()
+        self.total_words -= words
+        self.total_tokens -= tokens
+        return self._messages.popleft()
+
+    def pop(self, index=-1):
+        if index == 0:
+            return self.popleft()
+        if index in (-1, len(self._messages) - 1):
+            words, tokens = self._sizes.pop()
+            self.total_words -= words
+            self.total_tokens -= tokens
+            return self._messages.pop()
+        message = self._messages[index]
+        words, tokens = self._sizes[index]
+        del self._messages[index]
+        del self._sizes[index]
+        self.total_words -= words
+        self.total_tokens -= tokens
+        return message
+
+    def sizes(self):
+        return list(self._sizes)
+
+    def token_sizes(self):
+        return [tokens for _, tokens in self._sizes]
+
+    def clear(self):
+        self._messages.clear()
+        self._sizes.clear()
+        self.total_words = 0
+        self.total_tokens = 0
+
+    def trim(self, max_words=None, max_tokens=None):
+        while len(self._messages) > 1 and (
+            (max_words is not None and self.total_words > max_words)
+            or (max_tokens is not None and self.total_tokens > max_tokens)
+        ):
+            self.popleft()
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._messages)[index]
+        return self._messages[index]
+
+    def __add__(self, other):
+        return list(self._messages) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self._messages)
+
+    def __bool__(self):
+        return bool(self._messages)
+
+    def __repr__(self):
+        return f"MessageHistory({list(self._messages)!r})"
@@ -1,9 +1,14 @@
 from dataclasses import dataclass, field
 from typing import List, Dict
+import time
 import asyncio
 from termcolor import colored
 from unified import UnifiedApis
-import subprocess
+from structured_output import extract_tagged
+from budget import Budget, budget_phase
+from discussion_topology import get_topology, TOPOLOGIES
+from discussion_transcript import DiscussionTranscript
+from code_runner import CodeRunner
 import os
 
 
@@ -275,15 +280,35 @@ In discussions, provide insights that reflect your expertise in quality assuranc
 @dataclass
 class CodingTeam:
     members: List[TeamMember] = field(default_factory=list)
-    error_corrector: UnifiedApis = UnifiedApis(
-        name="ErrorFixer",
-        provider="anthropic",
-        model="claude-3-5-sonnet-20240620",
-        use_async=True,
-        print_color="red",
+    # A factory so the agent is built per team, not when the class is defined.
+    error_corrector: UnifiedApis = field(
+        default_factory=lambda: UnifiedApis(
+            name="ErrorFixer",
+            provider="anthropic",
+            model="claude-3-5-sonnet-20240620",
+            use_async=True,
+            print_color="red",
+        )
     )
+    # Team-wide ledger; every agent books its calls to a child ledger of it.
+    budget: Budget = None
+    # Default for discuss_project: "sequential", "parallel", "architect-first" or a
+    # DiscussionTopology.
+    topology: str = "sequential"
+    discussion_metrics: Dict = field(default_factory=dict)
+    transcript: DiscussionTranscript = None
+    # Runs the generated program with time, memory and output limits.
+    runner: CodeRunner = field(default_factory=CodeRunner)
+
+    def __post_init__(self):
+        if self.budget is not None:
+            self.error_corrector.budget = self.budget.child(self.error_corrector.name)
+            for member in self.members:
+                member.ai_agent.budget = self.budget.child(member.name)
 
     def add_member(self, member: TeamMember):
+        if self.budget is not None:
+            member.ai_agent.budget = self.budget.child(member.name)
         self.members.append(member)
 
     def list_members(self):
@@ -303,36 +328,75 @@ class CodingTeam:
             )
             print()
 
-    async def discuss_project(self, project_description: str, iterations: int):
-        discussion = []
+    @budget_phase("discussion")
+    async def discuss_project(
+        self, project_description: str, iterations: int, topology=None
+    ):
+        topology = get_topology(topology or self.topology)
+        waves = topology.waves(self.members)
+        started = time.monotonic()
+        round_seconds = []
+        self.transcript = transcript = DiscussionTranscript()
         for i in range(iterations):
             print(colored(f"\nIteration {i+1}/{iterations}", "cyan"))
-            round_responses = []
-            for member in self.members:
-                full_discussion = "\n".join(discussion)
-                round_responses_text = "\n".join(round_responses)
-                prompt = f"""Discuss the following project:
+            round_started = time.monotonic()
+            for wave in waves:
+                # Members of one wave see the same turns and speak concurrently.
+                visible = len(transcript)
+                prompts = [
+                    self._discussion_prompt(
+                        member, project_description, transcript, visible
+                    )
+                    for member in wave
+                ]
+                responses = await asyncio.gather(
+                    *[member.discuss(prompt) for member, prompt in zip(wave, prompts)]
+                )
+                for member, response in zip(wave, responses):
+                    transcript.add(member, response)
+                    # Print each response as it's generated
+                    print(colored(response, member.ai_agent.print_color))
+            round_seconds.append(time.monotonic() - round_started)
+        self.discussion_metrics = {
+            "topology": topology.name,
+            "iterations": iterations,
+            "waves": [[member.name for member in wave] for wave in waves],
+            "round_seconds": round_seconds,
+            "seconds": time.monotonic() - started,
+        }
+        print(
+            colored(
+                f"Discussion took {self.discussion_metrics['seconds']:.1f}s (topology={topology.name})",
+                "cyan",
+            )
+        )
+        return transcript.text()
+
+    def _discussion_prompt(self, member, project_description, transcript, visible):
+        # Each member keeps its own earlier prompts and replies in its history, so
+        # after its first turn it is only sent the turns it has not seen yet.
+        if transcript.has_joined(member) and not any(
+            project_description in str(message["content"])
+            for message in member.ai_agent.history
+        ):
+            transcript.forget(member)
+        joined = transcript.has_joined(member)
+        new_turns = "\n\n".join(transcript.unseen(member, visible))
+        if joined:
+            return f"""New comments from the team since your last turn:
+{new_turns or "(none)"}
 
-{project_description}
+Please continue the discussion, taking into account the project description and previous comments from team members."""
+        return f"""Discuss the following project:
 
-Current round's responses:
-{round_responses_text}
+{project_description}
 
-Previous discussion:
-{full_discussion}
+Discussion so far:
+{new_turns or "(no comments yet)"}
 
 Please continue the discussion, taking into account the project description and previous comments from team members."""
 
-                response = await member.discuss(prompt)
-                colored_response = colored(
-                    f"{member.name} ({member.role}): {response}",
-                    member.ai_agent.print_color,
-                )
-                round_responses.append(colored_response)
-                print(colored_response)  # Print each response as it's generated
-            discussion.extend(round_responses)
-        return "\n".join(discussion)
-
+    @budget_phase("generation")
     async def generate_code(
         self, project_description: str, discussion: str, file_path: str
     ):
@@ -351,45 +415,58 @@ Provide the full code wrapped in <code></code> tags."""
 
         code_response = await lead_developer.discuss(prompt)
 
-        code = code_response.split("<code>")[1].split("</code>")[0].strip()
+        code = extract_tagged(code_response, "code")
         with open(file_path, "w") as f:
             f.write(code)
         print(colored(f"Initial code written to {file_path}", "green"))
         return code
 
+    @budget_phase("correction")
     async def error_correction_cycle(self, file_path: str):
-        while True:
+        max_attempts = self.runner.max_attempts
+        for attempt in range(max_attempts + 1):
             print(colored("\nExecuting code...", "cyan"))
-            try:
-                result = subprocess.run(
-                    ["python", file_path], capture_output=True, text=True, check=True
-                )
-                print(colored("Code execution successful!", "green"))
+            result = await self.runner.run_async(file_path)
+            if result.ok or result.inconclusive:
+                if result.ok:
+                    print(colored("Code execution successful!", "green"))
+                else:
+                    print(colored(result.note(), "yellow"))
                 if result.stdout:
                     print(colored("Output:", "blue"))
                     print(result.stdout)
-                return  # Exit the method if execution is successful
-            except subprocess.CalledProcessError as e:
-                error_message = e.stderr
-                print(colored(f"Error detected: {error_message}", "red"))
-                with open(file_path, "r") as f:
-                    current_code = f.read()
-
-                print(colored("Attempting to fix the error...", "yellow"))
-                correction_prompt = f"Error message:\n{error_message}\n\nCurrent code:\n{current_code}\n\nPlease fix the error and provide the full corrected code wrapped in <code></code> tags."
-                corrected_code_response = await self.error_corrector.chat_async(
-                    correction_prompt
-                )
+                return result
+            error_message = result.report()
+            print(colored(f"Error detected: {error_message}", "red"))
+            if attempt == max_attempts:
+                break
+            with open(file_path, "r") as f:
+                current_code = f.read()
 
-                corrected_code = (
-                    corrected_code_response.split("<code>")[1]
-                    .split("</code>")[0]
-                    .strip()
+            print(
+                colored(
+                    f"Attempting to fix the error ({attempt + 1}/{max_attempts})...",
+                    "yellow",
                 )
-                with open(file_path, "w") as f:
-                    f.write(corrected_code)
-                print(colored("Applied fix. Retrying execution...", "magenta"))
+            )
+            correction_prompt = f"Error message:\n{error_message}\n\nCurrent code:\n{current_code}\n\nPlease fix the error and provide the full corrected code wrapped in <code></code> tags."
+            corrected_code_response = await self.error_corrector.chat_async(
+                correction_prompt
+            )
+
+            corrected_code = extract_tagged(corrected_code_response, "code")
+            with open(file_path, "w") as f:
+                f.write(corrected_code)
+            print(colored("Applied fix. Retrying execution...", "magenta"))
+        print(
+            colored(
+                f"Giving up after {max_attempts} fix attempts; the code still fails.",
+                "red",
+            )
+        )
+        return result
 
+    @budget_phase("feedback")
     async def feedback_improvement_cycle(self, file_path: str, user_feedback: str):
         with open(file_path, "r") as f:
             current_code = f.read()
@@ -416,9 +493,7 @@ Provide the full code wrapped in <code></code> tags."""
         improvement_prompt = f"User feedback: {user_feedback}\n\nTeam suggestions:\n{' '.join(suggestions)}\n\nCurrent code:\n{current_code}\n\nPlease improve the code based on the user feedback and the best elements from the team suggestions. Provide the full improved code wrapped in <code></code> tags."
         improved_code_response = await lead_developer.discuss(improvement_prompt)
 
-        improved_code = (
-            improved_code_response.split("<code>")[1].split("</code>")[0].strip()
-        )
+        improved_code = extract_tagged(improved_code_response, "code")
         with open(file_path, "w") as f:
             f.write(improved_code)
         print(colored(f"Improved code written to {file_path}", "green"))
@@ -457,6 +532,20 @@ Provide the full code wrapped in <code></code> tags."""
             iterations = int(
                 input(colored("Enter number of discussion iterations: ", "cyan"))
             )
+            topology = (
+                input(
+                    colored(
+                        f"Discussion mode ({'/'.join(TOPOLOGIES)}, default {self.topology}): ",
+                        "cyan",
+                    )
+                )
+                .strip()
+                .lower()
+            )
+            while topology and topology not in TOPOLOGIES:
+                print(colored(f"Error: Unknown discussion mode {topology}.", "red"))
+                topology = input(colored("Please enter a valid mode: ", "cyan"))
+                topology = topology.strip().lower()
             file_path = input(colored("Enter output file path: ", "cyan"))
             while not file_path.endswith(".py"):
                 print(
@@ -470,7 +559,9 @@ Provide the full code wrapped in <code></code> tags."""
                 )
 
             print(colored("Starting project discussion...", "cyan"))
-            discussion = await self.discuss_project(project_description, iterations)
+            discussion = await self.discuss_project(
+                project_description, iterations, topology or None
+            )
             await self.generate_code(project_description, discussion, file_path)
             await self.error_correction_cycle(file_path)
 
@@ -493,18 +584,30 @@ Provide the full code wrapped in <code></code> tags."""
         )
 
 
-# Create the team
-team = CodingTeam()
+def create_team(budget: Budget = None, runner: CodeRunner = None):
+    team = CodingTeam(budget=budget, runner=runner or CodeRunner())
+
+    # Add team members
+    team.add_member(ProjectLead("Alice"))
+    team.add_member(SoftwareArchitect("Frank"))
+    team.add_member(QualityAssuranceEngineer("Grace"))
+    team.add_member(AISpecialist("Bob"))
+    team.add_member(UIUXDesigner("Charlie"))
+    team.add_member(BackendDeveloper("David"))
+    team.add_member(FrontendDeveloper("Eve"))
+    return team
+
+
+def __getattr__(name):
+    # `from multi_agent_coding_team import team` still works, but the team is only
+    # built on first access instead of at import time.
+    if name == "team":
+        globals()["team"] = create_team()
+        return globals()["team"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Add team members
-team.add_member(ProjectLead("Alice"))
-team.add_member(SoftwareArchitect("Frank"))
-team.add_member(QualityAssuranceEngineer("Grace"))
-team.add_member(AISpecialist("Bob"))
-team.add_member(UIUXDesigner("Charlie"))
-team.add_member(BackendDeveloper("David"))
-team.add_member(FrontendDeveloper("Eve"))
 
 # Example usage
 if __name__ == "__main__":
+    team = create_team()
     asyncio.run(team.run_project())
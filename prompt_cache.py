@@ -0,0 +1,104 @@
+import threading
+from message_history import content_text
+
+
+ANTHROPIC_MAX_BREAKPOINTS = 4
+# Anthropic ignores cache_control on prefixes shorter than this (2048 for Haiku models).
+ANTHROPIC_MIN_CACHEABLE_TOKENS = 1024
+
+
+def _with_cache_control(message):
+    content = message["content"]
+    if isinstance(content, list):
+        blocks = [dict(block) for block in content]
+    else:
+        blocks = [{"type": "text", "text": str(content)}]
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return {**message, "content": blocks}
+
+
+class PromptCachePlanner:
+    """Places Anthropic cache_control breakpoints on the system prompt and the largest stable history prefixes."""
+
+    def __init__(
+        self,
+        max_breakpoints=ANTHROPIC_MAX_BREAKPOINTS,
+        min_cacheable_tokens=ANTHROPIC_MIN_CACHEABLE_TOKENS,
+    ):
+        self.max_breakpoints = max_breakpoints
+        self.min_cacheable_tokens = min_cacheable_tokens
+        self.calls = 0
+        self.input_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.cache_creation_input_tokens = 0
+        self._lock = threading.Lock()
+
+    def choose_breakpoints(self, system_tokens, message_tokens):
+        # Returns (cache the system prompt?, sorted message indexes to mark).
+        budget = self.max_breakpoints
+        cache_system = system_tokens >= self.min_cacheable_tokens
+        if cache_system:
+            budget -= 1
+        if budget <= 0 or not message_tokens:
+            return cache_system, []
+
+        prefix = system_tokens
+        eligible = []
+        for index, tokens in enumerate(message_tokens):
+            prefix += tokens
+            if prefix >= self.min_cacheable_tokens:
+                eligible.append(index)
+        if not eligible:
+            return cache_system, []
+
+        # The newest message always gets one so the next turn can read the whole
+        # conversation; the rest go after the biggest messages (large code contexts),
+        # which are the most expensive prefixes to resend uncached.
+        chosen = {len(message_tokens) - 1}
+        by_size = sorted(
+            eligible, key=lambda index: message_tokens[index], reverse=True
+        )
+        for index in by_size:
+            if len(chosen) >= budget:
+                break
+            chosen.add(index)
+        return cache_system, sorted(chosen)
+
+    def plan(self, system_message, history):
+        system_text = content_text(system_message)
+        message_tokens = history.token_sizes()
+        cache_system, indexes = self.choose_breakpoints(
+            history.token_counter(system_text), message_tokens
+        )
+        system_block = {"type": "text", "text": system_text}
+        if cache_system:
+            system_block["cache_control"] = {"type": "ephemeral"}
+        messages = list(history)
+        for index in indexes:
+            messages[index] = _with_cache_control(messages[index])
+        return [system_block], messages
+
+    def record_usage(self, record):
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += record.input_tokens or 0
+            self.cache_read_input_tokens += record.cache_read_input_tokens or 0
+            self.cache_creation_input_tokens += record.cache_creation_input_tokens or 0
+
+    @property
+    def hit_rate(self):
+        total = (
+            self.input_tokens
+            + self.cache_read_input_tokens
+            + self.cache_creation_input_tokens
+        )
+        return self.cache_read_input_tokens / total if total else 0.0
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "cache_read_input_tokens": self.cache_read_input_tokens,
+            "cache_creation_input_tokens": self.cache_creation_input_tokens,
+            "hit_rate": self.hit_rate,
+        }
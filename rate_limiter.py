@@ -0,0 +1,135 @@
+import time
+import asyncio
+import weakref
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate_per_minute``; reservations may go into debt."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.capacity = capacity or rate_per_minute
+        self.fill_rate = rate_per_minute / 60.0
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.fill_rate
+        )
+        self.updated = now
+
+    def reserve(self, amount):
+        # Debit immediately and return how long the caller must wait for the debt to clear,
+        # so concurrent callers queue up in reservation order.
+        with self._lock:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.fill_rate
+
+    def adjust(self, amount):
+        with self._lock:
+            self._refill()
+            self.tokens = max(-self.capacity, min(self.capacity, self.tokens - amount))
+
+
+class RateLimiter:
+    def __init__(
+        self, requests_per_minute=None, tokens_per_minute=None, max_in_flight=None
+    ):
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_in_flight = max_in_flight
+        self._thread_semaphore = (
+            threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        )
+        self._loop_semaphores = weakref.WeakKeyDictionary()
+        self.in_flight = 0
+        self.waited = 0.0
+
+    def _reserve(self, tokens):
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        self.waited += wait
+        return wait
+
+    def _async_semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._loop_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._loop_semaphores[loop] = semaphore
+        return semaphore
+
+    def record_usage(self, reserved_tokens, actual_tokens):
+        if self.tokens and actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - reserved_tokens)
+
+    @contextmanager
+    def limit(self, tokens=0):
+        wait = self._reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        if self._thread_semaphore:
+            self._thread_semaphore.acquire()
+        self.in_flight += 1
+        try:
+            yield self
+        finally:
+            self.in_flight -= 1
+            if self._thread_semaphore:
+                self._thread_semaphore.release()
+
+    @asynccontextmanager
+    async def limit_async(self, tokens=0):
+        wait = self._reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        semaphore = self._async_semaphore() if self.max_in_flight else None
+        if semaphore:
+            await semaphore.acquire()
+        self.in_flight += 1
+        try:
+            yield self
+        finally:
+            self.in_flight -= 1
+            if semaphore:
+                semaphore.release()
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def configure_rate_limit(
+    provider,
+    model=None,
+    requests_per_minute=None,
+    tokens_per_minute=None,
+    max_in_flight=None,
+):
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute, max_in_flight)
+    with _lock:
+        _limiters[(provider.lower(), model)] = limiter
+    return limiter
+
+
+def get_rate_limiter(provider, model=None):
+    # A model-specific limit wins over the provider-wide one.
+    with _lock:
+        return _limiters.get((provider, model)) or _limiters.get((provider, None))
+
+
+def clear_rate_limits():
+    with _lock:
+        _limiters.clear()
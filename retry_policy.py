@@ -0,0 +1,169 @@
+import re
+import sys
+import time
+import random
+import email.utils
+from datetime import datetime
+from structured_output import StructuredOutputError
+
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429}
+FATAL_EXCEPTIONS = (
+    TypeError,
+    AttributeError,
+    NameError,
+    KeyError,
+    NotImplementedError,
+    AssertionError,
+    # Already given its targeted repair requests; a full retry would not help.
+    StructuredOutputError,
+)
+
+
+def sdk_errors(name):
+    # Looked up lazily so importing this module does not load the SDKs; an SDK that
+    # has not been imported yet cannot have raised anything.
+    return tuple(
+        getattr(sys.modules[module], name)
+        for module in ("openai", "anthropic")
+        if module in sys.modules
+    )
+
+
+class RetryError(Exception):
+    def __init__(self, message, attempts, last_error=None):
+        super().__init__(message)
+        self.attempts = attempts
+        self.last_error = last_error
+
+
+def _parse_duration(value):
+    # OpenAI reset headers look like "1s", "6m0s", "250ms" or "1h2m3.5s".
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value):
+        matched = True
+        amount = float(amount)
+        if unit == "ms":
+            total += amount / 1000
+        elif unit == "s":
+            total += amount
+        elif unit == "m":
+            total += amount * 60
+        elif unit == "h":
+            total += amount * 3600
+    return total if matched else None
+
+
+def _parse_timestamp(value):
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return max(0.0, reset_at.timestamp() - time.time())
+
+
+def retry_after_seconds(headers):
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                parsed = email.utils.parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                # Malformed header: fall back to the backoff delay.
+                parsed = None
+            if parsed is not None:
+                return max(0.0, parsed.timestamp() - time.time())
+    resets = []
+    for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(name)
+        if value:
+            resets.append(_parse_duration(value))
+    for name in (
+        "anthropic-ratelimit-requests-reset",
+        "anthropic-ratelimit-tokens-reset",
+        "anthropic-ratelimit-input-tokens-reset",
+        "anthropic-ratelimit-output-tokens-reset",
+    ):
+        value = headers.get(name)
+        if value:
+            resets.append(_parse_timestamp(value))
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+class RetryPolicy:
+    """Decides whether a failed provider call is retried and how long to wait first."""
+
+    def __init__(
+        self,
+        max_retries=10,
+        base_delay=1.0,
+        max_delay=60.0,
+        deadline=300.0,
+        jitter=True,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.jitter = jitter
+
+    def is_retryable(self, error):
+        if isinstance(error, sdk_errors("APIStatusError")):
+            return (
+                error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+            )
+        if isinstance(error, sdk_errors("APIConnectionError")):
+            return True
+        return not isinstance(error, FATAL_EXCEPTIONS)
+
+    def retry_after(self, error):
+        response = getattr(error, "response", None)
+        return retry_after_seconds(getattr(response, "headers", None))
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2**attempt))
+        if self.jitter:
+            return random.uniform(0, delay)
+        return delay
+
+    def request_timeout(self, started, limit=None):
+        # Seconds the next attempt may take: what is left of the deadline, capped at
+        # limit (the HTTP pool's timeout).
+        if self.deadline is None:
+            return limit
+        remaining = max(0.0, self.deadline - (time.monotonic() - started))
+        return remaining if limit is None else min(remaining, limit)
+
+    def next_delay(self, attempt, error, started):
+        """Return seconds to wait before retry number ``attempt + 1``, or raise if the call should stop."""
+        if not self.is_retryable(error):
+            raise error
+        if attempt + 1 >= self.max_retries:
+            raise RetryError("Max retries reached", attempt + 1, error) from error
+
+        delay = self.backoff(attempt)
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            if self.jitter:
+                delay += random.uniform(0, min(1.0, self.base_delay))
+
+        if self.deadline is not None:
+            remaining = self.deadline - (time.monotonic() - started)
+            if delay >= remaining:
+                raise RetryError(
+                    "Retry deadline exceeded", attempt + 1, error
+                ) from error
+        return delay
@@ -0,0 +1,125 @@
+from contextvars import ContextVar
+from contextlib import contextmanager
+from message_history import MessageHistory
+
+
+# The Session whose conversation an agent's methods are currently working on. Each
+# thread and asyncio task has its own value, so concurrent sessions never see each
+# other's state.
+active_session = ContextVar("active_session", default=None)
+
+
+class Session:
+    """One conversation (history, system message, summary) served by a shared UnifiedApis agent."""
+
+    __slots__ = (
+        "agent",
+        "history",
+        "turn",
+        "system_message",
+        "compactor",
+        "session_id",
+    )
+
+    def __init__(
+        self,
+        agent,
+        system_message="You are a helpful assistant.",
+        history=None,
+        compactor=None,
+        session_id=None,
+    ):
+        self.agent = agent
+        self.history = history if history is not None else MessageHistory()
+        self.turn = 1
+        self.system_message = system_message
+        self.compactor = compactor
+        self.session_id = session_id
+
+    @contextmanager
+    def active(self):
+        token = active_session.set(self)
+        try:
+            yield self
+        finally:
+            active_session.reset(token)
+
+    def _call(self, method, *args, **kwargs):
+        with self.active():
+            return getattr(self.agent, method)(*args, **kwargs)
+
+    async def _call_async(self, method, *args, **kwargs):
+        with self.active():
+            return await getattr(self.agent, method)(*args, **kwargs)
+
+    def _stream(self, method, *args, **kwargs):
+        # A generator runs in its consumer's context, so the session is made active
+        # around each step instead of for the generator's whole lifetime.
+        with self.active():
+            stream = getattr(self.agent, method)(*args, **kwargs)
+        try:
+            while True:
+                with self.active():
+                    try:
+                        chunk = next(stream)
+                    except StopIteration:
+                        return
+                yield chunk
+        finally:
+            with self.active():
+                stream.close()
+
+    async def _stream_async(self, method, *args, **kwargs):
+        with self.active():
+            stream = getattr(self.agent, method)(*args, **kwargs)
+        try:
+            while True:
+                with self.active():
+                    try:
+                        chunk = await stream.__anext__()
+                    except StopAsyncIteration:
+                        return
+                yield chunk
+        finally:
+            with self.active():
+                await stream.aclose()
+
+    def chat(self, user_input, response_model=None, **kwargs):
+        return self._call("chat", user_input, response_model=response_model, **kwargs)
+
+    async def chat_async(self, user_input, response_model=None, **kwargs):
+        return await self._call_async(
+            "chat_async", user_input, response_model=response_model, **kwargs
+        )
+
+    def chat_stream(self, user_input, **kwargs):
+        self.add_message("user", user_input)
+        return self.get_response_stream(**kwargs)
+
+    def chat_stream_async(self, user_input, **kwargs):
+        self.add_message("user", user_input)
+        return self.get_response_stream_async(**kwargs)
+
+    def get_response(self, **kwargs):
+        return self._call("get_response", **kwargs)
+
+    async def get_response_async(self, **kwargs):
+        return await self._call_async("get_response_async", **kwargs)
+
+    def get_response_stream(self, **kwargs):
+        return self._stream("get_response_stream", **kwargs)
+
+    def get_response_stream_async(self, **kwargs):
+        return self._stream_async("get_response_stream_async", **kwargs)
+
+    def add_message(self, role, content):
+        self._call("add_message", role, content)
+
+    def set_system_message(self, message=None):
+        self._call("set_system_message", message)
+
+    def clear_history(self):
+        self._call("clear_history")
+
+    def trim_history(self):
+        self._call("trim_history")
@@ -0,0 +1,174 @@
+import os
+import json
+import mmap
+import uuid
+import sqlite3
+import threading
+from urllib.parse import quote, unquote
+
+
+CLEAR = {"event": "clear"}
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def _encode(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+def _after_clear(records):
+    # A clear marker hides every message before it; the latest system message survives.
+    messages, system = [], None
+    for record in records:
+        if record.get("event") == "clear":
+            messages = []
+        elif record.get("role") == "system":
+            system = record
+        else:
+            messages.append(record)
+    return ([system] if system else []) + messages
+
+
+class JsonlSessionStore:
+    """Append-only JSONL transcript per session; each record is written with a single append."""
+
+    def __init__(self, directory, mmap_threshold=1024 * 1024):
+        self.directory = directory
+        self.mmap_threshold = mmap_threshold
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f"{quote(session_id, safe='')}.jsonl")
+
+    def append(self, session_id, record):
+        line = (_encode(record) + "\n").encode("utf-8")
+        # O_APPEND makes each write land at the current end of file, so several
+        # processes can append to one session without tearing each other's lines.
+        with self._lock:
+            fd = os.open(
+                self._path(session_id), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+            )
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def clear(self, session_id):
+        self.append(session_id, CLEAR)
+
+    def _lines(self, data):
+        # The last line may still be being written by another process; skip it until
+        # its newline lands.
+        start = 0
+        end = data.rfind(b"\n") + 1
+        while start < end:
+            newline = data.find(b"\n", start, end)
+            line = data[start:newline]
+            start = newline + 1
+            if line.strip():
+                yield json.loads(line)
+
+    def load(self, session_id):
+        try:
+            f = open(self._path(session_id), "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return []
+            if size < self.mmap_threshold:
+                return _after_clear(self._lines(f.read()))
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                # Only the part after the last clear needs to be decoded; the system
+                # message is looked up separately since it may come before the clear.
+                marker = b"\n" + _encode(CLEAR).encode("utf-8") + b"\n"
+                start = data.rfind(marker) + 1
+                if not start:
+                    return _after_clear(self._lines(data))
+                system = self._last_system(data, start)
+                records = list(self._lines(data[start:]))
+                return _after_clear(([system] if system else []) + records)
+
+    def _last_system(self, data, end):
+        position = data.rfind(b'{"role":"system"', 0, end)
+        while position > 0 and data[position - 1 : position] != b"\n":
+            position = data.rfind(b'{"role":"system"', 0, position)
+        if position < 0:
+            return None
+        return json.loads(data[position : data.find(b"\n", position)])
+
+    def sessions(self):
+        return sorted(
+            unquote(name[: -len(".jsonl")])
+            for name in os.listdir(self.directory)
+            if name.endswith(".jsonl")
+        )
+
+    def delete(self, session_id):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+class SqliteSessionStore:
+    """Session transcripts in one SQLite file in WAL mode, so other processes can read while one writes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "session_id TEXT NOT NULL, "
+                "role TEXT, "
+                "record TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS messages_session "
+                "ON messages (session_id, role, id)"
+            )
+
+    def append(self, session_id, record):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO messages (session_id, role, record) VALUES (?, ?, ?)",
+                (session_id, record.get("role"), _encode(record)),
+            )
+
+    def clear(self, session_id):
+        self.append(session_id, CLEAR)
+
+    def load(self, session_id):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT record FROM messages WHERE session_id = ? AND ("
+                "role = 'system' OR id > COALESCE((SELECT MAX(id) FROM messages "
+                "WHERE session_id = ? AND role IS NULL), 0)) ORDER BY id",
+                (session_id, session_id),
+            ).fetchall()
+        return _after_clear(json.loads(record) for (record,) in rows)
+
+    def sessions(self):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT session_id FROM messages ORDER BY session_id"
+            ).fetchall()
+        return [session_id for (session_id,) in rows]
+
+    def delete(self, session_id):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM messages WHERE session_id = ?", (session_id,)
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
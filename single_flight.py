@@ -0,0 +1,118 @@
+import asyncio
+import threading
+
+
+class CoalescedRequestCancelled(Exception):
+    pass
+
+
+class Flight:
+    """One in-flight upstream request whose chunks and result are shared with every waiter."""
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.followers = 0
+        self._condition = threading.Condition()
+        self._waiters = []
+
+    def _notify(self):
+        self._condition.notify_all()
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiter's loop has already closed.
+                pass
+
+    def publish(self, text):
+        with self._condition:
+            self.chunks.append(text)
+            self._notify()
+
+    def _land(self, result=None, error=None):
+        with self._condition:
+            if self.done:
+                return
+            self.result = result
+            self.error = error
+            self.done = True
+            self._notify()
+
+    def follow(self):
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.chunks) and not self.done:
+                    self._condition.wait()
+                chunks, done = self.chunks[index:], self.done
+            index += len(chunks)
+            yield from chunks
+            if done:
+                break
+        if self.error is not None:
+            raise self.error
+
+    async def follow_async(self):
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._condition:
+            self._waiters.append(waiter)
+        try:
+            index = 0
+            while True:
+                with self._condition:
+                    chunks, done = self.chunks[index:], self.done
+                    if not chunks and not done:
+                        event.clear()
+                if not chunks and not done:
+                    await event.wait()
+                    continue
+                index += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                if done:
+                    break
+        finally:
+            with self._condition:
+                self._waiters.remove(waiter)
+        if self.error is not None:
+            raise self.error
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same request key share one upstream request."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        # Returns (flight, is_leader); only the leader sends the request.
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key)
+            return flight, True
+
+    def land(self, flight, result=None, error=None):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        if error is not None and not isinstance(error, Exception):
+            # Cancellation of the leader (GeneratorExit, CancelledError) is not the
+            # followers' own cancellation, so they get an ordinary error instead.
+            error = CoalescedRequestCancelled("The shared request was cancelled")
+        flight._land(result, error)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._flights)
+
+
+shared_flights = SingleFlight()
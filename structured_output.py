@@ -0,0 +1,102 @@
+import re
+import json
+
+
+class StructuredOutputError(ValueError):
+    def __init__(self, message, raw=None):
+        super().__init__(message)
+        self.raw = raw
+
+
+def tool_definition(provider, response_model):
+    # Returns (tool, tool_choice) forcing the model to answer through the schema.
+    name = response_model.__name__
+    description = (
+        response_model.__doc__ or f"Return the response as a {name} object."
+    ).strip()
+    schema = response_model.model_json_schema()
+    if provider == "anthropic":
+        return (
+            {"name": name, "description": description, "input_schema": schema},
+            {"type": "tool", "name": name},
+        )
+    return (
+        {
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": description,
+                "parameters": schema,
+            },
+        },
+        {"type": "function", "function": {"name": name}},
+    )
+
+
+def response_format(response_model):
+    # OpenAI's strict JSON schema format, built the way beta.chat.completions.parse
+    # builds it. The reply is validated here instead of in the SDK, so a mismatch
+    # gets a repair request rather than an exception from the request itself.
+    from openai.lib._parsing import type_to_response_format_param
+
+    return type_to_response_format_param(response_model)
+
+
+def extract_json(text):
+    # Models that ignore tool_choice sometimes answer with JSON in the text instead.
+    fence = re.search(r"```(?:json)?\s*\n(.*?)```", text, re.S)
+    if fence:
+        text = fence.group(1)
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        return text[start : end + 1]
+    return text
+
+
+def tool_arguments(provider, response):
+    if provider == "anthropic":
+        for block in response.content:
+            if block.type == "tool_use":
+                return block.input
+        text = "".join(getattr(block, "text", "") for block in response.content)
+    else:
+        message = response.choices[0].message
+        if message.tool_calls:
+            return message.tool_calls[0].function.arguments
+        text = message.content or ""
+    return extract_json(text)
+
+
+def validate(response_model, raw):
+    from pydantic import ValidationError
+
+    try:
+        if isinstance(raw, (str, bytes)):
+            return response_model.model_validate_json(raw)
+        return response_model.model_validate(raw)
+    except ValidationError as e:
+        errors = "; ".join(
+            f"{'.'.join(str(part) for part in error['loc']) or 'output'}: {error['msg']}"
+            for error in e.errors(include_url=False)
+        )
+        raise StructuredOutputError(errors, raw) from e
+
+
+def repair_message(response_model, error):
+    raw = error.raw if isinstance(error.raw, str) else json.dumps(error.raw)
+    return {
+        "role": "user",
+        "content": f"Your last {response_model.__name__} output did not match the schema.\n\nOutput:\n{raw}\n\nErrors:\n{error}\n\nReturn the corrected {response_model.__name__}, keeping every valid field unchanged.",
+    }
+
+
+def extract_tagged(text, tag="code"):
+    # Tolerates a missing closing tag (truncated reply) and falls back to a fenced
+    # block or the whole reply instead of raising IndexError.
+    match = re.search(rf"<{tag}>(.*?)(?:</{tag}>|$)", text, re.S)
+    if match:
+        return match.group(1).strip()
+    fence = re.search(r"```[\w+-]*\n(.*?)(?:```|$)", text, re.S)
+    if fence:
+        return fence.group(1).strip()
+    return text.strip()
@@ -0,0 +1,254 @@
+import json
+import time
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+from termcolor import colored
+
+
+@dataclass
+class CallRecord:
+    agent: str
+    provider: str
+    model: str
+    stream: bool
+    started: float = field(default_factory=time.time)
+    latency: Optional[float] = None
+    time_to_first_token: Optional[float] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    cache_creation_input_tokens: Optional[int] = None
+    cache_read_input_tokens: Optional[int] = None
+    cost: Optional[float] = None
+    retries: int = 0
+    repairs: int = 0
+    continuations: int = 0
+    error: Optional[str] = None
+    cached: bool = False
+    coalesced: bool = False
+    _clock: float = field(default_factory=time.monotonic, repr=False)
+
+    def elapsed(self):
+        return time.monotonic() - self._clock
+
+    def mark_first_token(self):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = self.elapsed()
+
+    def to_dict(self):
+        record = asdict(self)
+        del record["_clock"]
+        return record
+
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+
+def add_telemetry_hook(hook):
+    with _hooks_lock:
+        _hooks.append(hook)
+    return hook
+
+
+def remove_telemetry_hook(hook):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def emit(record, hooks=()):
+    with _hooks_lock:
+        targets = list(_hooks)
+    for hook in list(hooks) + targets:
+        try:
+            hook(record)
+        except Exception as e:
+            print(colored(f"Telemetry hook error: {e}", "red"))
+
+
+def print_cache_usage(record):
+    print(colored("\nCache Usage:", "yellow"))
+    print(colored(f"Input tokens: {record.input_tokens}", "yellow"))
+    print(
+        colored(
+            f"Cache creation input tokens: {record.cache_creation_input_tokens}",
+            "yellow",
+        )
+    )
+    print(
+        colored(f"Cache read input tokens: {record.cache_read_input_tokens}", "yellow")
+    )
+    print(colored(f"Output tokens: {record.output_tokens}", "yellow"))
+
+
+class InMemoryTelemetry:
+    def __init__(self, max_records=None):
+        self.max_records = max_records
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.max_records and len(self.records) > self.max_records:
+                del self.records[0]
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+
+    def summary(self, key="agent"):
+        with self._lock:
+            records = list(self.records)
+        groups = defaultdict(list)
+        for record in records:
+            groups[getattr(record, key)].append(record)
+        summary = {}
+        for name, group in groups.items():
+            latencies = sorted(r.latency for r in group if r.latency is not None)
+            first_tokens = [
+                r.time_to_first_token
+                for r in group
+                if r.time_to_first_token is not None
+            ]
+            summary[name] = {
+                "calls": len(group),
+                "errors": sum(1 for r in group if r.error),
+                "cached": sum(1 for r in group if r.cached),
+                "coalesced": sum(1 for r in group if r.coalesced),
+                "retries": sum(r.retries for r in group),
+                "repairs": sum(r.repairs for r in group),
+                "continuations": sum(r.continuations for r in group),
+                "total_latency": sum(latencies),
+                "mean_latency": (
+                    sum(latencies) / len(latencies) if latencies else None
+                ),
+                "p95_latency": (
+                    latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                    if latencies
+                    else None
+                ),
+                "mean_time_to_first_token": (
+                    sum(first_tokens) / len(first_tokens) if first_tokens else None
+                ),
+                "input_tokens": sum(r.input_tokens or 0 for r in group),
+                "output_tokens": sum(r.output_tokens or 0 for r in group),
+                "cache_read_input_tokens": sum(
+                    r.cache_read_input_tokens or 0 for r in group
+                ),
+                "cache_creation_input_tokens": sum(
+                    r.cache_creation_input_tokens or 0 for r in group
+                ),
+                "cost": sum(r.cost or 0 for r in group),
+            }
+        return summary
+
+
+class JsonlTelemetry:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class PrometheusTelemetry:
+    """Aggregates records into Prometheus text exposition format (see ``render``)."""
+
+    buckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, prefix="unified"):
+        self.prefix = prefix
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _observe(self, name, labels, value):
+        histogram = self._histograms.setdefault(
+            (name, labels), {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        )
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def __call__(self, record):
+        labels = (
+            ("agent", record.agent),
+            ("provider", record.provider),
+            ("model", record.model),
+        )
+        if record.error:
+            status = "error"
+        elif record.cached:
+            status = "cached"
+        elif record.coalesced:
+            status = "coalesced"
+        else:
+            status = "ok"
+        with self._lock:
+            self._counters[("calls_total", labels + (("status", status),))] += 1
+            self._counters[("retries_total", labels)] += record.retries
+            if record.error:
+                self._counters[
+                    ("errors_total", labels + (("error", record.error),))
+                ] += 1
+            for kind in ("input", "output", "cache_read_input", "cache_creation_input"):
+                value = getattr(record, f"{kind}_tokens")
+                if value:
+                    self._counters[
+                        ("tokens_total", labels + (("type", kind),))
+                    ] += value
+            if record.latency is not None:
+                self._observe("call_latency_seconds", labels, record.latency)
+            if record.time_to_first_token is not None:
+                self._observe(
+                    "time_to_first_token_seconds", labels, record.time_to_first_token
+                )
+
+    @staticmethod
+    def _labels(labels):
+        escaped = (
+            (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for k, v in labels
+        )
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{self._labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            metric = f"{self.prefix}_{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} histogram")
+                declared.add(metric)
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                bucket_labels = labels + (("le", str(bound)),)
+                lines.append(f"{metric}_bucket{self._labels(bucket_labels)} {count}")
+            inf_labels = labels + (("le", "+Inf"),)
+            lines.append(
+                f"{metric}_bucket{self._labels(inf_labels)} {histogram['count']}"
+            )
+            lines.append(f"{metric}_sum{self._labels(labels)} {histogram['sum']}")
+            lines.append(f"{metric}_count{self._labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write(self.render())
@@ -0,0 +1,116 @@
+import sys
+import time
+import atexit
+import threading
+from termcolor import colored
+
+
+class TerminalRenderer:
+    """Batches streamed text from concurrent agents into one terminal write per frame."""
+
+    def __init__(self, interval=0.05, headless=False, out=None):
+        self.interval = interval
+        self.headless = headless
+        self.out = out
+        self.frames = 0
+        self._buffers = {}
+        self._active = set()
+        self._prefixed = set()
+        self._open = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def write(self, source, text, color=None, label=None):
+        # source identifies the writer (agents may share a name); label is shown as
+        # the line prefix.
+        if self.headless or not text:
+            return
+        with self._lock:
+            self._active.add(source)
+            buffer = self._buffers.setdefault(source, [label or str(source), color, []])
+            buffer[1] = color
+            buffer[2].append(text)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="terminal-renderer", daemon=True
+                )
+                self._thread.start()
+        self._wake.set()
+
+    def end(self, source):
+        # The agent's reply is complete: its last line is closed and written right
+        # away, so output printed after the call still appears after the reply.
+        if self.headless:
+            return
+        with self._lock:
+            self._write(self._frame(closing=source))
+            self._active.discard(source)
+            self._prefixed.discard(source)
+
+    def flush(self):
+        with self._lock:
+            self._write(self._frame())
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            time.sleep(self.interval)
+            self.flush()
+
+    def _frame(self, closing=None):
+        # With one agent streaming, text is written as it arrives. With several, only
+        # complete lines are written, each prefixed with the agent's name.
+        concurrent = len(self._active) > 1
+        if concurrent:
+            # Once prefixed, a reply keeps its prefix until it ends.
+            self._prefixed |= self._active
+        out = []
+        if closing is not None and closing not in self._buffers:
+            self._buffers[closing] = [None, None, []]
+        for source, (label, color, parts) in list(self._buffers.items()):
+            text = "".join(parts)
+            if source == closing:
+                if text or self._open == source:
+                    text += "\n"
+            elif concurrent:
+                cut = text.rfind("\n") + 1
+                text, rest = text[:cut], text[cut:]
+                if rest:
+                    self._buffers[source] = [label, color, [rest]]
+                    self._emit(source, label, color, text, out)
+                    continue
+            del self._buffers[source]
+            self._emit(source, label, color, text, out)
+        return "".join(out)
+
+    def _emit(self, source, label, color, text, out):
+        if not text:
+            return
+        if self._open not in (None, source):
+            out.append("\n")
+            self._open = None
+        for line in text.splitlines(keepends=True):
+            body = line.rstrip("\n")
+            if source in self._prefixed and self._open != source:
+                body = f"[{label}] {body}"
+            if body:
+                out.append(colored(body, color) if color else body)
+            if line.endswith("\n"):
+                out.append("\n")
+                self._open = None
+            else:
+                self._open = source
+
+    def _write(self, frame):
+        if not frame:
+            return
+        out = self.out or sys.stdout
+        out.write(frame)
+        out.flush()
+        self.frames += 1
+
+
+shared_renderer = TerminalRenderer()
+atexit.register(shared_renderer.flush)
@@ -1,34 +1,114 @@
 import os
+import copy
 import json
-from openai import OpenAI
-from anthropic import Anthropic
-from openai import AsyncOpenAI
-from anthropic import AsyncAnthropic
+import hashlib
 from termcolor import colored
 import time
 import asyncio
-from pydantic import BaseModel
-from typing import Any, Optional
+from typing import Any, Optional, TYPE_CHECKING
+from dataclasses import dataclass
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from response_cache import ResponseCache
+from message_history import MessageHistory, content_text
+from client_registry import get_client, new_client, pool_timeout
+from retry_policy import RetryPolicy
+from rate_limiter import RateLimiter, get_rate_limiter
+from contextlib import nullcontext, contextmanager
+from telemetry import CallRecord, emit, print_cache_usage
+from prompt_cache import PromptCachePlanner
+from history_compaction import HistoryCompactor
+from hedging import HedgePolicy, HedgeLeg, hedged_stream, hedged_stream_async
+from single_flight import shared_flights
+from json_stream import IncrementalJSONParser
+from session_store import new_session_id
+from session import Session, active_session
+from terminal_renderer import TerminalRenderer, shared_renderer
+from budget import Budget, call_cost
+from structured_output import (
+    StructuredOutputError,
+    tool_definition,
+    tool_arguments,
+    validate,
+    repair_message,
+    response_format,
+)
+from batching import (
+    BATCH_PROVIDERS,
+    conversation_messages,
+    openai_batch_lines,
+    anthropic_batch_requests,
+    run_openai_batch,
+    run_openai_batch_async,
+    run_anthropic_batch,
+    run_anthropic_batch_async,
+)
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+
+@dataclass
+class StreamChunk:
+    type: str
+    text: str = ""
+    value: Any = None
+    path: tuple = ()
+
+
+def _session_attribute(name):
+    # Per-conversation state lives on the active Session, or on the agent's own
+    # default session when it is used directly.
+    return property(
+        lambda self: getattr(self._state(), name),
+        lambda self, value: setattr(self._state(), name, value),
+    )
 
 
 class UnifiedApis:
+    history = _session_attribute("history")
+    turn = _session_attribute("turn")
+    system_message = _session_attribute("system_message")
+    compactor = _session_attribute("compactor")
+    session_id = _session_attribute("session_id")
+    # Set on the forks that answer a sync hedged request.
+    _leg = None
+
     def __init__(
         self,
         name="Unified Apis",
         api_key=None,
+        base_url=None,
+        share_client=True,
         max_history_words=10000,
+        max_history_tokens=None,
+        token_counter=None,
+        compactor: Optional[HistoryCompactor] = None,
         max_words_per_message=None,
         json_mode=False,
         stream=True,
         use_async=False,
         max_retry=10,
+        retry_policy: Optional[RetryPolicy] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        hedge: Optional[HedgePolicy] = None,
+        budget: Optional[Budget] = None,
         provider="anthropic",
         model=None,
         should_print_init=True,
         print_color="green",
+        renderer: Optional[TerminalRenderer] = None,
         use_cache=False,
         cache_interval=10,
+        cache_planner: Optional[PromptCachePlanner] = None,
         print_cache_usage=False,
+        response_cache: Optional[ResponseCache] = None,
+        coalesce=True,
+        structured_repairs=1,
+        max_continuations=2,
+        session_store=None,
+        session_id=None,
+        telemetry=None,
     ):
 
         self.provider = provider.lower()
@@ -38,23 +118,56 @@ class UnifiedApis:
             self.model = model or "claude-3-5-sonnet-20240620"
         elif self.provider == "openrouter":
             self.model = model or "google/gemini-pro-1.5"
+        elif self.provider == "local":
+            self.model = model or "local-model"
         self.name = name
         self.api_key = api_key or self._get_api_key()
-        self.history = []
+        self.base_url = base_url or self._get_base_url()
+        self.share_client = share_client
+        self._default = Session(
+            self,
+            history=MessageHistory(token_counter=token_counter),
+            compactor=compactor,
+        )
         self.max_history_words = max_history_words
+        self.max_history_tokens = max_history_tokens
         self.max_words_per_message = max_words_per_message
         self.json_mode = json_mode
         self.stream = stream
         self.use_async = use_async
         self.max_retry = max_retry
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=max_retry)
+        self.rate_limiter = rate_limiter
+        self.hedge = hedge
+        self._hedge_template = None
+        self.budget = budget
         self.print_color = print_color
+        self.renderer = renderer or shared_renderer
         self.system_message = "You are a helpful assistant."
         if self.provider == "openai" and self.json_mode:
             self.system_message += " Please return your response in JSON unless user has specified a system message."
         self.use_cache = use_cache
         self.cache_interval = cache_interval
+        self.cache_planner = cache_planner or (
+            PromptCachePlanner() if use_cache else None
+        )
         self.turn = 1
         self.print_cache_usage = print_cache_usage
+        self.response_cache = response_cache
+        self.coalesce = coalesce
+        self.structured_repairs = structured_repairs
+        self.max_continuations = max_continuations
+        if telemetry is None:
+            self.telemetry = []
+        elif isinstance(telemetry, (list, tuple)):
+            self.telemetry = list(telemetry)
+        else:
+            self.telemetry = [telemetry]
+
+        self.session_store = session_store
+        self.session_id = session_id or (new_session_id() if session_store else None)
+        if session_store is not None:
+            self._resume_session()
 
         self._initialize_client()
 
@@ -66,6 +179,31 @@ class UnifiedApis:
                 )
             )
 
+    def _state(self):
+        session = active_session.get()
+        if session is not None and session.agent is self:
+            return session
+        return self._default
+
+    def session(self, system_message=None, session_id=None):
+        # A new conversation sharing this agent's configuration and client. Sessions
+        # start from the agent's system message and can be used concurrently.
+        session = Session(
+            self,
+            system_message=self._default.system_message,
+            history=MessageHistory(token_counter=self._default.history.token_counter),
+            compactor=(
+                self._default.compactor.copy() if self._default.compactor else None
+            ),
+        )
+        if self.session_store is not None:
+            session.session_id = session_id or new_session_id()
+            with session.active():
+                self._resume_session()
+        if system_message is not None:
+            session.set_system_message(system_message)
+        return session
+
     def _get_api_key(self):
         if self.provider == "openai":
             return os.getenv("OPENAI_API_KEY") or "YOUR_OPENAI_KEY_HERE"
@@ -73,28 +211,41 @@ class UnifiedApis:
             return os.getenv("ANTHROPIC_API_KEY") or "YOUR_ANTHROPIC_KEY_HERE"
         elif self.provider == "openrouter":
             return os.getenv("OPENROUTER_API_KEY") or "YOUR_OPENROUTER_KEY_HERE"
+        elif self.provider == "local":
+            return "local"
         else:
             raise ValueError(f"Unsupported provider: {self.provider}")
 
+    def _get_base_url(self):
+        if self.provider == "openai":
+            return os.getenv("OPENAI_BASE_URL")
+        elif self.provider == "anthropic":
+            return os.getenv("ANTHROPIC_BASE_URL")
+        elif self.provider == "openrouter":
+            return os.getenv("OPENROUTER_BASE_URL") or "https://openrouter.ai/api/v1"
+        elif self.provider == "local":
+            return os.getenv("LOCAL_API_BASE_URL") or "http://127.0.0.1:8765/v1"
+
     def _initialize_client(self):
-        if self.provider == "openai" and self.use_async:
-            self.client = AsyncOpenAI(api_key=self.api_key)
-        elif self.provider == "anthropic" and self.use_async:
-            self.client = AsyncAnthropic(api_key=self.api_key)
-        elif self.provider == "openrouter" and self.use_async:
-            self.client = AsyncOpenAI(
-                base_url="https://openrouter.ai/api/v1", api_key=self.api_key
-            )
-        elif self.provider == "openai" and not self.use_async:
-            self.client = OpenAI(api_key=self.api_key)
-        elif self.provider == "anthropic" and not self.use_async:
-            self.client = Anthropic(api_key=self.api_key)
-        elif self.provider == "openrouter" and not self.use_async:
-            self.client = OpenAI(
-                base_url="https://openrouter.ai/api/v1", api_key=self.api_key
+        # Clients (and the SDKs behind them) are created on first use, not here.
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None and not self.share_client:
+            self._client = new_client(
+                self.provider, self.api_key, self.use_async, self.base_url
             )
+        if self._client is not None:
+            return self._client
+        return get_client(self.provider, self.api_key, self.use_async, self.base_url)
+
+    @client.setter
+    def client(self, value):
+        self._client = value
 
     def set_system_message(self, message=None):
+        previous = self.system_message
         self.system_message = message or "You are a helpful assistant."
         if (
             self.provider == "openai"
@@ -102,13 +253,10 @@ class UnifiedApis:
             and "json" not in message.lower()
         ):
             self.system_message += " Please return your response in JSON unless user has specified a system message."
-
-        if self.use_cache:
-            self.system_message = {
-                "type": "text",
-                "text": self.system_message,
-                "cache_control": {"type": "ephemeral"},
-            }
+        if self.session_store is not None and self.system_message != previous:
+            self.session_store.append(
+                self.session_id, {"role": "system", "content": self.system_message}
+            )
 
     async def set_system_message_async(self, message=None):
         self.set_system_message(message)
@@ -119,51 +267,68 @@ class UnifiedApis:
 
         message = {"role": role, "content": str(content)}
 
-        if self.use_cache and self.turn % self.cache_interval == 0:
-            if isinstance(message["content"], str):
-                message["content"] = [{"type": "text", "text": message["content"]}]
-            message["content"][0]["cache_control"] = {"type": "ephemeral"}
-
         self.history.append(message)
         self.turn += 1
+        if self.session_store is not None:
+            self.session_store.append(self.session_id, message)
 
     async def add_message_async(self, role, content):
         self.add_message(role, content)
 
     def print_history_length(self):
-        history_length = sum(
-            len(str(message["content"]).split()) for message in self.history
+        print(
+            f"\nCurrent history length is {self.history.total_words} words (~{self.history.total_tokens} tokens)"
         )
-        print(f"\nCurrent history length is {history_length} words")
 
     async def print_history_length_async(self):
         self.print_history_length()
 
     def clear_history(self):
         self.history.clear()
+        if self.compactor:
+            self.compactor.reset()
+        if self.session_store is not None:
+            self.session_store.clear(self.session_id)
+
+    def _resume_session(self):
+        # Rebuilds the conversation from the store's transcript instead of replaying it
+        # through the API. The full transcript stays in the store; history is trimmed.
+        for message in self.session_store.load(self.session_id):
+            if message["role"] == "system":
+                self.system_message = message["content"]
+            else:
+                self.history.append(message)
+                self.turn += 1
+        self.history.trim(
+            max_words=self.max_history_words, max_tokens=self.max_history_tokens
+        )
 
     async def clear_history_async(self):
         self.clear_history()
 
-    def chat(self, user_input, response_model: Optional[BaseModel] = None, **kwargs):
+    def chat(self, user_input, response_model: Optional["BaseModel"] = None, **kwargs):
         self.add_message("user", user_input)
         return self.get_response(response_model=response_model, **kwargs)
 
     async def chat_async(
-        self, user_input, response_model: Optional[BaseModel] = None, **kwargs
+        self, user_input, response_model: Optional["BaseModel"] = None, **kwargs
     ):
         await self.add_message_async("user", user_input)
         return await self.get_response_async(response_model=response_model, **kwargs)
 
+    def _system_prompt(self):
+        if self.compactor:
+            return self.compactor.system_prompt(self.system_message)
+        return self.system_message
+
     def trim_history(self):
-        words_count = sum(
-            len(str(message["content"]).split())
-            for message in self.history
-            if message["role"] != "system"
+        # With a compactor, old turns are folded into a summary before the hard limit
+        # below ever has to drop them.
+        if self.compactor:
+            self.compactor.compact(self)
+        self.history.trim(
+            max_words=self.max_history_words, max_tokens=self.max_history_tokens
         )
-        while words_count > self.max_history_words and len(self.history) > 1:
-            words_count -= len(self.history[0]["content"].split())
-            self.history.pop(0)
 
     async def trim_history_async(self):
         self.trim_history()
@@ -176,277 +341,1188 @@ class UnifiedApis:
             ):
                 del message["content"][0]["cache_control"]
 
+    def _response_cache_key(
+        self, max_tokens, anthropic_max_tokens, response_model, kwargs
+    ):
+        return ResponseCache.make_key(
+            {
+                "provider": self.provider,
+                "model": self.model,
+                "system": content_text(self._system_prompt()),
+                "history": [
+                    [message["role"], content_text(message["content"])]
+                    for message in self.history
+                ],
+                "json_mode": self.json_mode,
+                "max_tokens": max_tokens,
+                "anthropic_max_tokens": anthropic_max_tokens,
+                "response_model": (
+                    response_model.model_json_schema() if response_model else None
+                ),
+                "kwargs": kwargs,
+            }
+        )
+
+    def _get_rate_limiter(self):
+        return self.rate_limiter or get_rate_limiter(self.provider, self.model)
+
+    def _estimate_request_tokens(self, max_tokens):
+        system_tokens = self.history.token_counter(content_text(self._system_prompt()))
+        return system_tokens + self.history.total_tokens + max_tokens
+
+    def _rate_limit(self, tokens):
+        limiter = self._get_rate_limiter()
+        return limiter.limit(tokens) if limiter else nullcontext()
+
+    def _rate_limit_async(self, tokens):
+        limiter = self._get_rate_limiter()
+        return limiter.limit_async(tokens) if limiter else nullcontext()
+
+    def _record_rate_limit_usage(
+        self, limiter, output_budget, assistant_response, record
+    ):
+        if limiter is None:
+            return
+        # Swap the max_tokens reservation for the size of what was actually generated.
+        output_tokens = record.output_tokens
+        if output_tokens is None:
+            output_tokens = self.history.token_counter(str(assistant_response))
+        limiter.record_usage(output_budget, output_tokens)
+
+    def _start_record(self, stream):
+        return CallRecord(
+            agent=self.name, provider=self.provider, model=self.model, stream=stream
+        )
+
+    def _finish_record(self, record, error=None):
+        record.latency = record.elapsed()
+        if not (record.cached or record.coalesced):
+            record.cost = call_cost(record)
+        if self.budget is not None:
+            self.budget.record(record)
+        if error is not None:
+            record.error = type(error).__name__
+        elif self.use_cache and self.provider == "anthropic" and not record.cached:
+            self.cache_planner.record_usage(record)
+            if self.print_cache_usage:
+                print_cache_usage(record)
+        emit(record, self.telemetry)
+
+    @staticmethod
+    def _record_usage(record, usage):
+        if usage is None:
+            return
+        input_tokens = getattr(usage, "input_tokens", None)
+        if input_tokens is None:
+            input_tokens = getattr(usage, "prompt_tokens", None)
+        output_tokens = getattr(usage, "output_tokens", None)
+        if output_tokens is None:
+            output_tokens = getattr(usage, "completion_tokens", None)
+        cache_read = getattr(usage, "cache_read_input_tokens", None)
+        if cache_read is None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            cache_read = getattr(details, "cached_tokens", None)
+        cache_creation = getattr(usage, "cache_creation_input_tokens", None)
+        if input_tokens is not None:
+            record.input_tokens = input_tokens
+        if output_tokens is not None:
+            record.output_tokens = output_tokens
+        if cache_read is not None:
+            record.cache_read_input_tokens = cache_read
+        if cache_creation is not None:
+            record.cache_creation_input_tokens = cache_creation
+
+    def _chunk_usage(self, chunk):
+        if self.provider == "anthropic":
+            if chunk.type == "message_start":
+                return chunk.message.usage
+            if chunk.type == "message_delta":
+                return chunk.usage
+            return None
+        return getattr(chunk, "usage", None)
+
+    def _print_chunk(self, content, color):
+        self.renderer.write(self._state(), content, color, self.name)
+
+    def _print_end(self):
+        self.renderer.end(self._state())
+
+    def _decode_cached_response(self, cached, color, should_print, response_model):
+        if self.stream and not response_model:
+            if should_print:
+                self._print_chunk(cached, color)
+            self._print_end()
+        if response_model:
+            return response_model.model_validate_json(cached)
+        if self.json_mode and self.provider == "openai":
+            return json.loads(cached)
+        return cached
+
+    def _store_cached_response(self, cache_key, assistant_response):
+        if cache_key is None:
+            return
+        if hasattr(assistant_response, "model_dump_json"):
+            self.response_cache.set(cache_key, assistant_response.model_dump_json())
+        elif isinstance(assistant_response, str):
+            self.response_cache.set(cache_key, assistant_response)
+        else:
+            self.response_cache.set(cache_key, json.dumps(assistant_response))
+
+    def _create_request(
+        self,
+        stream,
+        response_model,
+        max_tokens,
+        anthropic_max_tokens,
+        kwargs,
+        extra_messages=(),
+    ):
+        # Returns the SDK response for sync clients and an awaitable for async ones.
+        messages = list(self.history) + list(extra_messages)
+        if response_model and self.provider != "openai":
+            tool, tool_choice = tool_definition(self.provider, response_model)
+            kwargs = {"tools": [tool], "tool_choice": tool_choice, **kwargs}
+        if self.provider == "openai":
+            if response_model:
+                return self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "system", "content": self._system_prompt()}]
+                    + messages,
+                    max_tokens=max_tokens,
+                    response_format=response_format(response_model),
+                    **kwargs,
+                )
+            return self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "system", "content": self._system_prompt()}]
+                + messages,
+                stream=stream,
+                max_tokens=max_tokens,
+                # A continuation is a fragment of the JSON reply, not a whole object.
+                response_format=(
+                    {"type": "json_object"}
+                    if self.json_mode and not extra_messages
+                    else None
+                ),
+                **self._stream_options(stream, kwargs),
+            )
+        elif self.provider == "anthropic":
+            if self.use_cache:
+                system, planned = self.cache_planner.plan(
+                    self._system_prompt(), self.history
+                )
+                return self.client.beta.prompt_caching.messages.create(
+                    model=self.model,
+                    system=system,
+                    messages=planned + list(extra_messages),
+                    stream=stream,
+                    max_tokens=anthropic_max_tokens,
+                    extra_headers={
+                        "anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"
+                    },
+                    **kwargs,
+                )
+            return self.client.messages.create(
+                model=self.model,
+                system=self._system_prompt(),
+                messages=messages,
+                stream=stream,
+                max_tokens=anthropic_max_tokens,
+                extra_headers={"anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"},
+                **kwargs,
+            )
+        elif self.provider == "openrouter" or self.provider == "local":
+            return self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "system", "content": self._system_prompt()}]
+                + messages,
+                stream=stream,
+                max_tokens=max_tokens,
+                **self._stream_options(stream, kwargs),
+            )
+
+    def _stream_options(self, stream, kwargs):
+        # Ask for a final usage chunk so streamed calls report token counts too.
+        if stream and self.provider in ("openai", "local"):
+            return {"stream_options": {"include_usage": True}, **kwargs}
+        return kwargs
+
+    def _chunk_text(self, chunk):
+        if self.provider in ("openai", "openrouter", "local"):
+            if chunk.choices and chunk.choices[0].delta.content:
+                return chunk.choices[0].delta.content
+            return None
+        elif self.provider == "anthropic":
+            return chunk.delta.text if chunk.type == "content_block_delta" else None
+
+    def _response_text(self, response):
+        if self.provider in ("openai", "openrouter", "local"):
+            return response.choices[0].message.content
+        elif self.provider == "anthropic":
+            return response.content[0].text
+
+    def _decode_response(self, text):
+        if self.json_mode and self.provider == "openai":
+            return json.loads(text)
+        return text
+
+    def _json_parser(self):
+        if self.json_mode and self.provider == "openai":
+            return IncrementalJSONParser()
+        return None
+
+    def _text_chunks(self, content, parser):
+        yield StreamChunk("text", content)
+        if parser is not None:
+            for path, value in parser.feed(content):
+                yield StreamChunk("json", "", value, path)
+
+    def _done_chunk(self, text, parser):
+        if parser is not None and parser.done:
+            return StreamChunk("done", text, parser.value)
+        return StreamChunk("done", text, self._decode_response(text))
+
+    def _continuation_messages(self, partial):
+        return [
+            {"role": "assistant", "content": partial},
+            {
+                "role": "user",
+                "content": "Your reply was cut off. Continue exactly where it stopped, without repeating anything or adding commentary.",
+            },
+        ]
+
+    def _should_continue(self, parser, record):
+        # A JSON reply whose stream stops inside an open value (cut off at max_tokens
+        # or by a dropped connection) is finished by a continuation request instead
+        # of being regenerated from scratch.
+        return (
+            parser is not None
+            and parser.incomplete
+            and record.continuations < self.max_continuations
+        )
+
+    def _interrupted(self, error, parser, record):
+        return self._should_continue(parser, record) and self.retry_policy.is_retryable(
+            error
+        )
+
+    def _stream_reply(
+        self,
+        response,
+        record,
+        flight,
+        parts,
+        parser,
+        max_tokens,
+        anthropic_max_tokens,
+        kwargs,
+    ):
+        usage = record
+        while True:
+            if self._leg is not None:
+                self._leg.track(response)
+            try:
+                for chunk in response:
+                    self._record_usage(usage, self._chunk_usage(chunk))
+                    content = self._chunk_text(chunk)
+                    if not content:
+                        continue
+                    record.mark_first_token()
+                    parts.append(content)
+                    if flight is not None:
+                        flight.publish(content)
+                    yield from self._text_chunks(content, parser)
+            except Exception as e:
+                if self._leg is not None:
+                    self._leg.check()
+                if not self._interrupted(e, parser, record):
+                    raise
+            if self._leg is not None:
+                self._leg.check()
+            if usage is not record:
+                self._add_usage(record, usage)
+            if not self._should_continue(parser, record):
+                return
+            record.continuations += 1
+            print(
+                colored(
+                    "Reply stopped inside open JSON, requesting a continuation",
+                    "yellow",
+                )
+            )
+            usage = self._start_record(True)
+            response = self._create_request(
+                True,
+                None,
+                max_tokens,
+                anthropic_max_tokens,
+                kwargs,
+                self._continuation_messages("".join(parts)),
+            )
+
+    async def _stream_reply_async(
+        self,
+        response,
+        record,
+        flight,
+        parts,
+        parser,
+        max_tokens,
+        anthropic_max_tokens,
+        kwargs,
+    ):
+        usage = record
+        while True:
+            try:
+                async for chunk in response:
+                    self._record_usage(usage, self._chunk_usage(chunk))
+                    content = self._chunk_text(chunk)
+                    if not content:
+                        continue
+                    record.mark_first_token()
+                    parts.append(content)
+                    if flight is not None:
+                        flight.publish(content)
+                    for text_chunk in self._text_chunks(content, parser):
+                        yield text_chunk
+            except Exception as e:
+                if not self._interrupted(e, parser, record):
+                    raise
+            if usage is not record:
+                self._add_usage(record, usage)
+            if not self._should_continue(parser, record):
+                return
+            record.continuations += 1
+            print(
+                colored(
+                    "Reply stopped inside open JSON, requesting a continuation",
+                    "yellow",
+                )
+            )
+            usage = self._start_record(True)
+            response = await self._create_request(
+                True,
+                None,
+                max_tokens,
+                anthropic_max_tokens,
+                kwargs,
+                self._continuation_messages("".join(parts)),
+            )
+
+    def _validate_structured(self, response, response_model):
+        if self.provider == "openai":
+            message = response.choices[0].message
+            if getattr(message, "refusal", None):
+                raise StructuredOutputError(message.refusal, message.content)
+            return validate(response_model, message.content or "")
+        return validate(response_model, tool_arguments(self.provider, response))
+
+    @staticmethod
+    def _add_usage(record, extra):
+        for name in (
+            "input_tokens",
+            "output_tokens",
+            "cache_creation_input_tokens",
+            "cache_read_input_tokens",
+        ):
+            value = getattr(extra, name)
+            if value is not None:
+                setattr(record, name, (getattr(record, name) or 0) + value)
+
+    def _add_repair_usage(self, record, response):
+        repair = self._start_record(False)
+        self._record_usage(repair, getattr(response, "usage", None))
+        self._add_usage(record, repair)
+        record.repairs += 1
+
+    def _structured_response(
+        self, response, response_model, max_tokens, anthropic_max_tokens, kwargs, record
+    ):
+        # A schema mismatch gets a targeted repair request instead of a full retry.
+        for _ in range(self.structured_repairs):
+            try:
+                return self._validate_structured(response, response_model)
+            except StructuredOutputError as e:
+                print(colored(f"Repairing {response_model.__name__}: {e}", "yellow"))
+                response = self._create_request(
+                    False,
+                    response_model,
+                    max_tokens,
+                    anthropic_max_tokens,
+                    kwargs,
+                    [repair_message(response_model, e)],
+                )
+                self._add_repair_usage(record, response)
+        return self._validate_structured(response, response_model)
+
+    async def _structured_response_async(
+        self, response, response_model, max_tokens, anthropic_max_tokens, kwargs, record
+    ):
+        for _ in range(self.structured_repairs):
+            try:
+                return self._validate_structured(response, response_model)
+            except StructuredOutputError as e:
+                print(colored(f"Repairing {response_model.__name__}: {e}", "yellow"))
+                response = await self._create_request(
+                    False,
+                    response_model,
+                    max_tokens,
+                    anthropic_max_tokens,
+                    kwargs,
+                    [repair_message(response_model, e)],
+                )
+                self._add_repair_usage(record, response)
+        return self._validate_structured(response, response_model)
+
+    def _attempt_kwargs(self, kwargs, started):
+        # Bounds each attempt by what is left of the retry deadline, so one hung
+        # request cannot run on to the pool's read timeout.
+        timeout = self.retry_policy.request_timeout(started, pool_timeout())
+        if timeout is None or "timeout" in kwargs:
+            return kwargs
+        return {**kwargs, "timeout": timeout}
+
+    def _prepare_request(self, kwargs):
+        if self.budget is not None:
+            self.budget.check()
+        max_tokens = kwargs.pop("max_tokens", 4000)
+        anthropic_max_tokens = kwargs.pop("max_tokens", 8192)
+        output_budget = (
+            anthropic_max_tokens if self.provider == "anthropic" else max_tokens
+        )
+        return max_tokens, anthropic_max_tokens, output_budget
+
+    def _lookup_cached_response(
+        self, max_tokens, anthropic_max_tokens, response_model, kwargs
+    ):
+        if self.response_cache is None:
+            return None, None
+        cache_key = self._response_cache_key(
+            max_tokens, anthropic_max_tokens, response_model, kwargs
+        )
+        return cache_key, self.response_cache.get(cache_key)
+
+    def _commit_response(
+        self, limiter, output_budget, cache_key, assistant_response, record, flight
+    ):
+        self._record_rate_limit_usage(
+            limiter, output_budget, assistant_response, record
+        )
+        self._store_cached_response(cache_key, assistant_response)
+        self.add_message("assistant", str(assistant_response))
+        self.trim_history()
+        self._finish_record(record)
+        if flight is not None:
+            shared_flights.land(flight, result=assistant_response)
+
+    def _join_flight(
+        self, max_tokens, anthropic_max_tokens, response_model, kwargs, cache_key
+    ):
+        # Returns (flight, is_leader). Without coalescing every caller leads its own request.
+        if not self.coalesce:
+            return None, True
+        if cache_key is None:
+            cache_key = self._response_cache_key(
+                max_tokens, anthropic_max_tokens, response_model, kwargs
+            )
+        # Only callers billed to the same key, and wanting chunks the same way, share.
+        key_hash = hashlib.sha256(str(self.api_key).encode("utf-8")).hexdigest()
+        streamed = bool(self.stream and not response_model)
+        return shared_flights.join((self.base_url, key_hash, streamed, cache_key))
+
+    @contextmanager
+    def _leading(self, flight):
+        # Followers must never be left waiting, whatever ends the leader's call.
+        try:
+            yield
+        except BaseException as e:
+            if flight is not None:
+                shared_flights.land(flight, error=e)
+            raise
+
+    def _finish_follow(self, record, assistant_response):
+        self.add_message("assistant", str(assistant_response))
+        self.trim_history()
+        record.coalesced = True
+        self._finish_record(record)
+        return assistant_response
+
+    def _follow(self, flight, record, color, should_print):
+        try:
+            for content in flight.follow():
+                record.mark_first_token()
+                if self.stream and should_print:
+                    self._print_chunk(content, color)
+        except Exception as e:
+            self._finish_record(record, e)
+            raise
+        if self.stream and flight.chunks:
+            self._print_end()
+        return self._finish_follow(record, copy.deepcopy(flight.result))
+
+    async def _follow_async(self, flight, record, color, should_print):
+        try:
+            async for content in flight.follow_async():
+                record.mark_first_token()
+                if self.stream and should_print:
+                    self._print_chunk(content, color)
+        except Exception as e:
+            self._finish_record(record, e)
+            raise
+        if self.stream and flight.chunks:
+            self._print_end()
+        return self._finish_follow(record, copy.deepcopy(flight.result))
+
     def get_response(
         self,
         color=None,
         should_print=True,
-        response_model: Optional[BaseModel] = None,
+        response_model: Optional["BaseModel"] = None,
         **kwargs,
     ):
         if color is None:
             color = self.print_color
 
-        max_tokens = kwargs.pop("max_tokens", 4000)
-        anthropic_max_tokens = kwargs.pop("max_tokens", 8192)
+        if self.hedge and not response_model:
+            return self._hedged_response(color, should_print, kwargs)
 
-        if self.use_cache:
-            self.remove_previous_cache_keys()
+        max_tokens, anthropic_max_tokens, output_budget = self._prepare_request(kwargs)
 
-        retries = 0
-        while retries < self.max_retry:
-            try:
-                if self.provider == "openai":
-                    if response_model:
-                        response = self.client.beta.chat.completions.parse(
-                            model=self.model,
-                            messages=[
-                                {"role": "system", "content": self.system_message}
-                            ]
-                            + self.history,
-                            max_tokens=max_tokens,
-                            response_format=response_model,
-                            **kwargs,
-                        )
-                    else:
-                        response = self.client.chat.completions.create(
-                            model=self.model,
-                            messages=[
-                                {"role": "system", "content": self.system_message}
-                            ]
-                            + self.history,
-                            stream=self.stream,
-                            max_tokens=max_tokens,
-                            response_format=(
-                                {"type": "json_object"} if self.json_mode else None
-                            ),
-                            **kwargs,
-                        )
-                elif self.provider == "anthropic":
-                    if self.use_cache:
-                        response = self.client.beta.prompt_caching.messages.create(
-                            model=self.model,
-                            system=[self.system_message],
-                            messages=self.history,
-                            stream=self.stream,
-                            max_tokens=max_tokens,
-                            # extra_headers={"anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"},
-                            **kwargs,
-                        )
-                    else:
-                        response = self.client.messages.create(
-                            model=self.model,
-                            system=self.system_message,
-                            messages=self.history,
-                            stream=self.stream,
-                            max_tokens=anthropic_max_tokens,
-                            extra_headers={
-                                "anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"
-                            },
-                            **kwargs,
-                        )
-                elif self.provider == "openrouter":
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=[{"role": "system", "content": self.system_message}]
-                        + self.history,
-                        stream=self.stream,
-                        max_tokens=max_tokens,
-                        **kwargs,
-                    )
+        record = self._start_record(self.stream and not response_model)
+        cache_key, cached = self._lookup_cached_response(
+            max_tokens, anthropic_max_tokens, response_model, kwargs
+        )
+        if cached is not None:
+            assistant_response = self._decode_cached_response(
+                cached, color, should_print, response_model
+            )
+            self.add_message("assistant", str(assistant_response))
+            self.trim_history()
+            record.cached = True
+            self._finish_record(record)
+            return assistant_response
 
-                if self.stream and not response_model:
-                    assistant_response = ""
-                    for chunk in response:
-                        if self.provider == "openai" or self.provider == "openrouter":
-                            if chunk.choices[0].delta.content:
-                                content = chunk.choices[0].delta.content
-                            else:
-                                content = None
-                        elif self.provider == "anthropic":
-                            content = (
-                                chunk.delta.text
-                                if chunk.type == "content_block_delta"
-                                else None
-                            )
+        flight, leader = self._join_flight(
+            max_tokens,
+            anthropic_max_tokens,
+            response_model,
+            kwargs,
+            cache_key,
+        )
+        if not leader:
+            # Another caller is already sending this exact request.
+            return self._follow(flight, record, color, should_print)
 
-                        if content:
-                            if should_print:
-                                print(colored(content, color), end="", flush=True)
-                            assistant_response += content
-                    print()
-                else:
-                    if self.provider == "openai" or self.provider == "openrouter":
-                        assistant_response = response.choices[0].message.content
-                    elif self.provider == "anthropic":
-                        assistant_response = response.content[0].text
-                    if (
-                        self.use_cache
-                        and self.provider == "anthropic"
-                        and self.print_cache_usage
-                    ):
-                        print(colored("\nCache Usage:", "yellow"))
-                        print(
-                            colored(
-                                f"Input tokens: {response.usage.input_tokens}", "yellow"
-                            )
-                        )
-                        print(
-                            colored(
-                                f"Cache creation input tokens: {response.usage.cache_creation_input_tokens}",
-                                "yellow",
-                            )
+        with self._leading(flight):
+            estimated_tokens = self._estimate_request_tokens(output_budget)
+            retries = 0
+            started = time.monotonic()
+            while True:
+                attempt_kwargs = self._attempt_kwargs(kwargs, started)
+                try:
+                    with self._rate_limit(estimated_tokens) as limiter:
+                        response = self._create_request(
+                            self.stream and not response_model,
+                            response_model,
+                            max_tokens,
+                            anthropic_max_tokens,
+                            attempt_kwargs,
                         )
-                        print(
-                            colored(
-                                f"Cache read input tokens: {response.usage.cache_read_input_tokens}",
-                                "yellow",
+
+                        if self.stream and not response_model:
+                            parts = []
+                            parser = self._json_parser()
+                            for chunk in self._stream_reply(
+                                response,
+                                record,
+                                flight,
+                                parts,
+                                parser,
+                                max_tokens,
+                                anthropic_max_tokens,
+                                attempt_kwargs,
+                            ):
+                                if chunk.type == "text" and should_print:
+                                    self._print_chunk(chunk.text, color)
+                            self._print_end()
+                            assistant_response = self._done_chunk(
+                                "".join(parts), parser
+                            ).value
+                        elif response_model:
+                            self._record_usage(record, getattr(response, "usage", None))
+                            assistant_response = self._structured_response(
+                                response,
+                                response_model,
+                                max_tokens,
+                                anthropic_max_tokens,
+                                attempt_kwargs,
+                                record,
                             )
-                        )
-                        print(
-                            colored(
-                                f"Output tokens: {response.usage.output_tokens}",
-                                "yellow",
+                        else:
+                            self._record_usage(record, getattr(response, "usage", None))
+                            assistant_response = self._decode_response(
+                                self._response_text(response)
                             )
-                        )
-
-                if self.json_mode and self.provider == "openai":
-                    assistant_response = json.loads(assistant_response)
 
-                if response_model and self.provider == "openai":
-                    assistant_response = response.choices[0].message.parsed
-
-                self.add_message("assistant", str(assistant_response))
-                self.trim_history()
-
-                return assistant_response
-            except Exception as e:
-                print("Error:", e)
-                retries += 1
-                time.sleep(1)
-        raise Exception("Max retries reached")
+                        self._commit_response(
+                            limiter,
+                            output_budget,
+                            cache_key,
+                            assistant_response,
+                            record,
+                            flight,
+                        )
+                        return assistant_response
+                except Exception as e:
+                    print("Error:", e)
+                    try:
+                        delay = self.retry_policy.next_delay(retries, e, started)
+                    except Exception:
+                        self._finish_record(record, e)
+                        raise
+                    retries += 1
+                    record.retries = retries
+                    time.sleep(delay)
 
     async def get_response_async(
         self,
         color=None,
         should_print=True,
-        response_model: Optional[BaseModel] = None,
+        response_model: Optional["BaseModel"] = None,
         **kwargs,
     ):
         if color is None:
             color = self.print_color
 
-        max_tokens = kwargs.pop("max_tokens", 4000)
-        anthropic_max_tokens = kwargs.pop("max_tokens", 8192)
+        if self.hedge and not response_model:
+            return await self._hedged_response_async(color, should_print, kwargs)
 
-        if self.use_cache:
-            self.remove_previous_cache_keys()
+        max_tokens, anthropic_max_tokens, output_budget = self._prepare_request(kwargs)
 
-        retries = 0
-        while retries < self.max_retry:
-            try:
-                if self.provider == "openai":
-                    if response_model:
-                        response = await self.client.beta.chat.completions.parse(
-                            model=self.model,
-                            messages=[
-                                {"role": "system", "content": self.system_message}
-                            ]
-                            + self.history,
-                            max_tokens=max_tokens,
-                            response_format=response_model,
-                            **kwargs,
-                        )
-                    else:
-                        response = await self.client.chat.completions.create(
-                            model=self.model,
-                            messages=[
-                                {"role": "system", "content": self.system_message}
-                            ]
-                            + self.history,
-                            stream=self.stream,
-                            max_tokens=max_tokens,
-                            response_format=(
-                                {"type": "json_object"} if self.json_mode else None
-                            ),
-                            **kwargs,
+        record = self._start_record(self.stream and not response_model)
+        cache_key, cached = self._lookup_cached_response(
+            max_tokens, anthropic_max_tokens, response_model, kwargs
+        )
+        if cached is not None:
+            assistant_response = self._decode_cached_response(
+                cached, color, should_print, response_model
+            )
+            await self.add_message_async("assistant", str(assistant_response))
+            await self.trim_history_async()
+            record.cached = True
+            self._finish_record(record)
+            return assistant_response
+
+        flight, leader = self._join_flight(
+            max_tokens,
+            anthropic_max_tokens,
+            response_model,
+            kwargs,
+            cache_key,
+        )
+        if not leader:
+            # Another caller is already sending this exact request.
+            return await self._follow_async(flight, record, color, should_print)
+
+        with self._leading(flight):
+            estimated_tokens = self._estimate_request_tokens(output_budget)
+            retries = 0
+            started = time.monotonic()
+            while True:
+                attempt_kwargs = self._attempt_kwargs(kwargs, started)
+                try:
+                    async with self._rate_limit_async(estimated_tokens) as limiter:
+                        response = await self._create_request(
+                            self.stream and not response_model,
+                            response_model,
+                            max_tokens,
+                            anthropic_max_tokens,
+                            attempt_kwargs,
                         )
-                elif self.provider == "anthropic":
-                    if self.use_cache:
-                        response = (
-                            await self.client.beta.prompt_caching.messages.create(
-                                model=self.model,
-                                system=[self.system_message],
-                                messages=self.history,
-                                stream=self.stream,
-                                max_tokens=anthropic_max_tokens,
-                                extra_headers={
-                                    "anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"
-                                },
-                                **kwargs,
+
+                        if self.stream and not response_model:
+                            parts = []
+                            parser = self._json_parser()
+                            async for chunk in self._stream_reply_async(
+                                response,
+                                record,
+                                flight,
+                                parts,
+                                parser,
+                                max_tokens,
+                                anthropic_max_tokens,
+                                attempt_kwargs,
+                            ):
+                                if chunk.type == "text" and should_print:
+                                    self._print_chunk(chunk.text, color)
+                            self._print_end()
+                            assistant_response = self._done_chunk(
+                                "".join(parts), parser
+                            ).value
+                        elif response_model:
+                            self._record_usage(record, getattr(response, "usage", None))
+                            assistant_response = await self._structured_response_async(
+                                response,
+                                response_model,
+                                max_tokens,
+                                anthropic_max_tokens,
+                                attempt_kwargs,
+                                record,
                             )
+                        else:
+                            self._record_usage(record, getattr(response, "usage", None))
+                            assistant_response = self._decode_response(
+                                self._response_text(response)
+                            )
+
+                        self._commit_response(
+                            limiter,
+                            output_budget,
+                            cache_key,
+                            assistant_response,
+                            record,
+                            flight,
                         )
-                    else:
-                        response = await self.client.messages.create(
-                            model=self.model,
-                            system=self.system_message,
-                            messages=self.history,
-                            stream=self.stream,
-                            max_tokens=anthropic_max_tokens,
-                            extra_headers={
-                                "anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"
-                            },
-                            **kwargs,
-                        )
-                elif self.provider == "openrouter":
-                    response = await self.client.chat.completions.create(
-                        model=self.model,
-                        messages=[{"role": "system", "content": self.system_message}]
-                        + self.history,
-                        stream=self.stream,
-                        max_tokens=max_tokens,
-                        **kwargs,
+                        return assistant_response
+                except Exception as e:
+                    print("Error:", e)
+                    try:
+                        delay = self.retry_policy.next_delay(retries, e, started)
+                    except Exception:
+                        self._finish_record(record, e)
+                        raise
+                    retries += 1
+                    record.retries = retries
+                    await asyncio.sleep(delay)
+
+    def chat_stream(self, user_input, **kwargs):
+        self.add_message("user", user_input)
+        return self.get_response_stream(**kwargs)
+
+    def chat_stream_async(self, user_input, **kwargs):
+        self.add_message("user", user_input)
+        return self.get_response_stream_async(**kwargs)
+
+    def get_response_stream(self, **kwargs):
+        if self.hedge:
+            yield from self._hedged_stream(kwargs)
+            return
+
+        max_tokens, anthropic_max_tokens, output_budget = self._prepare_request(kwargs)
+
+        record = self._start_record(True)
+        cache_key, cached = self._lookup_cached_response(
+            max_tokens, anthropic_max_tokens, None, kwargs
+        )
+        if cached is not None:
+            record.mark_first_token()
+            parser = self._json_parser()
+            yield from self._text_chunks(cached, parser)
+            self.add_message("assistant", cached)
+            self.trim_history()
+            record.cached = True
+            self._finish_record(record)
+            yield self._done_chunk(cached, parser)
+            return
+
+        # Not coalesced: a follower would wait on a generator only its consumer advances.
+        estimated_tokens = self._estimate_request_tokens(output_budget)
+        retries = 0
+        started = time.monotonic()
+        while True:
+            attempt_kwargs = self._attempt_kwargs(kwargs, started)
+            parts = []
+            parser = self._json_parser()
+            try:
+                with self._rate_limit(estimated_tokens) as limiter:
+                    response = self._create_request(
+                        True, None, max_tokens, anthropic_max_tokens, attempt_kwargs
+                    )
+                    yield from self._stream_reply(
+                        response,
+                        record,
+                        None,
+                        parts,
+                        parser,
+                        max_tokens,
+                        anthropic_max_tokens,
+                        attempt_kwargs,
                     )
+                    assistant_response = "".join(parts)
+                    self._commit_response(
+                        limiter,
+                        output_budget,
+                        cache_key,
+                        assistant_response,
+                        record,
+                        None,
+                    )
+                break
+            except Exception as e:
+                # Text already handed to the consumer cannot be taken back, so only
+                # failures before the first chunk are retried.
+                if parts:
+                    self._finish_record(record, e)
+                    raise
+                print("Error:", e)
+                try:
+                    delay = self.retry_policy.next_delay(retries, e, started)
+                except Exception:
+                    self._finish_record(record, e)
+                    raise
+                retries += 1
+                record.retries = retries
+                time.sleep(delay)
+        yield self._done_chunk(assistant_response, parser)
 
-                if self.stream and not response_model:
-                    assistant_response = ""
-                    async for chunk in response:
-                        if self.provider == "openai" or self.provider == "openrouter":
-                            if chunk.choices[0].delta.content:
-                                content = chunk.choices[0].delta.content
-                            else:
-                                content = None
-                        elif self.provider == "anthropic":
-                            content = (
-                                chunk.delta.text
-                                if chunk.type == "content_block_delta"
-                                else None
-                            )
+    async def get_response_stream_async(self, **kwargs):
+        if self.hedge:
+            async for chunk in self._hedged_stream_async(kwargs):
+                yield chunk
+            return
+
+        max_tokens, anthropic_max_tokens, output_budget = self._prepare_request(kwargs)
+
+        record = self._start_record(True)
+        cache_key, cached = self._lookup_cached_response(
+            max_tokens, anthropic_max_tokens, None, kwargs
+        )
+        if cached is not None:
+            record.mark_first_token()
+            parser = self._json_parser()
+            for chunk in self._text_chunks(cached, parser):
+                yield chunk
+            self.add_message("assistant", cached)
+            self.trim_history()
+            record.cached = True
+            self._finish_record(record)
+            yield self._done_chunk(cached, parser)
+            return
 
-                        if content:
-                            if should_print:
-                                print(colored(content, color), end="", flush=True)
-                            assistant_response += content
-                    print()
-                else:
-                    if self.provider == "openai" or self.provider == "openrouter":
-                        assistant_response = response.choices[0].message.content
-                    elif self.provider == "anthropic":
-                        assistant_response = response.content[0].text
-
-                if self.json_mode and self.provider == "openai":
-                    assistant_response = json.loads(assistant_response)
-
-                if response_model and self.provider == "openai":
-                    assistant_response = response.choices[0].message.parsed
-
-                await self.add_message_async("assistant", str(assistant_response))
-                await self.trim_history_async()
-                return assistant_response
+        # Not coalesced: a follower would wait on a generator only its consumer advances.
+        estimated_tokens = self._estimate_request_tokens(output_budget)
+        retries = 0
+        started = time.monotonic()
+        while True:
+            attempt_kwargs = self._attempt_kwargs(kwargs, started)
+            parts = []
+            parser = self._json_parser()
+            try:
+                async with self._rate_limit_async(estimated_tokens) as limiter:
+                    response = await self._create_request(
+                        True, None, max_tokens, anthropic_max_tokens, attempt_kwargs
+                    )
+                    async for chunk in self._stream_reply_async(
+                        response,
+                        record,
+                        None,
+                        parts,
+                        parser,
+                        max_tokens,
+                        anthropic_max_tokens,
+                        attempt_kwargs,
+                    ):
+                        yield chunk
+                    assistant_response = "".join(parts)
+                    self._commit_response(
+                        limiter,
+                        output_budget,
+                        cache_key,
+                        assistant_response,
+                        record,
+                        None,
+                    )
+                break
             except Exception as e:
+                if parts:
+                    self._finish_record(record, e)
+                    raise
                 print("Error:", e)
+                try:
+                    delay = self.retry_policy.next_delay(retries, e, started)
+                except Exception:
+                    self._finish_record(record, e)
+                    raise
                 retries += 1
-                await asyncio.sleep(1)
-        raise Exception("Max retries reached")
+                record.retries = retries
+                await asyncio.sleep(delay)
+        yield self._done_chunk(assistant_response, parser)
+
+    def _hedge_leg(self, agent):
+        # Each leg answers a copy of this conversation; only the winner's reply is kept.
+        leg = agent._fork()
+        leg.hedge = None
+        # A losing leg is closed mid-request, which would fail any callers sharing it.
+        leg.coalesce = False
+        leg.compactor = None
+        leg.retry_policy = self.hedge.retry_policy
+        leg.system_message = self._system_prompt()
+        leg.history.extend(self.history)
+        return leg
+
+    def _hedge_legs(self):
+        if self._hedge_template is None:
+            self._hedge_template = UnifiedApis(
+                name=f"{self.name} ({self.hedge.provider})",
+                provider=self.hedge.provider,
+                model=self.hedge.model,
+                share_client=self.share_client,
+                max_history_words=self.max_history_words,
+                max_history_tokens=self.max_history_tokens,
+                token_counter=self.history.token_counter,
+                json_mode=self.json_mode,
+                use_async=self.use_async,
+                should_print_init=False,
+                print_color=self.print_color,
+                renderer=self.renderer,
+                budget=self.budget,
+                use_cache=self.use_cache,
+                print_cache_usage=self.print_cache_usage,
+                response_cache=self.response_cache,
+                telemetry=self.telemetry,
+            )
+        legs = [self._hedge_leg(self), self._hedge_leg(self._hedge_template)]
+        legs = [((leg.provider, leg.model), leg) for leg in legs]
+        if self.hedge.failed_over(legs[0][0]):
+            legs.reverse()
+        return legs
+
+    def _hedged_stream(self, kwargs):
+        legs = []
+        for key, leg in self._hedge_legs():
+            leg._leg = HedgeLeg()
+            legs.append(
+                (
+                    key,
+                    lambda leg=leg: leg.get_response_stream(**dict(kwargs)),
+                    leg._leg.cancel,
+                )
+            )
+        parser = self._json_parser()
+        for leg_chunk in hedged_stream(legs, self.hedge):
+            for chunk in self._winner_chunks(leg_chunk, parser):
+                if chunk.type == "done":
+                    self.add_message("assistant", chunk.text)
+                    self.trim_history()
+                yield chunk
+
+    async def _hedged_stream_async(self, kwargs):
+        legs = [
+            (key, lambda leg=leg: leg.get_response_stream_async(**dict(kwargs)))
+            for key, leg in self._hedge_legs()
+        ]
+        parser = self._json_parser()
+        async for leg_chunk in hedged_stream_async(legs, self.hedge):
+            for chunk in self._winner_chunks(leg_chunk, parser):
+                if chunk.type == "done":
+                    self.add_message("assistant", chunk.text)
+                    self.trim_history()
+                yield chunk
+
+    def _winner_chunks(self, chunk, parser):
+        # The winning leg's text is decoded the way this agent decodes its own replies,
+        # so json_mode returns the same type when the secondary provider wins.
+        if chunk.type == "text":
+            return list(self._text_chunks(chunk.text, parser))
+        if chunk.type == "done":
+            return [self._done_chunk(chunk.text, parser)]
+        return []
+
+    def _print_hedged_chunk(self, chunk, color, should_print):
+        if chunk.type == "text" and self.stream and should_print:
+            self._print_chunk(chunk.text, color)
+        elif chunk.type == "done" and self.stream:
+            self._print_end()
+
+    def _hedged_response(self, color, should_print, kwargs):
+        for chunk in self._hedged_stream(kwargs):
+            self._print_hedged_chunk(chunk, color, should_print)
+        return chunk.value
+
+    async def _hedged_response_async(self, color, should_print, kwargs):
+        async for chunk in self._hedged_stream_async(kwargs):
+            self._print_hedged_chunk(chunk, color, should_print)
+        return chunk.value
+
+    def _fork(self):
+        # Shares configuration, client and hooks but starts from an empty history.
+        fork = copy.copy(self)
+        fork._default = Session(
+            fork,
+            system_message=self.system_message,
+            history=MessageHistory(token_counter=self.history.token_counter),
+            compactor=self.compactor.copy() if self.compactor else None,
+        )
+        # Forks answer throwaway copies of the conversation and must not write to it.
+        fork.session_store = None
+        return fork
+
+    def _load_conversation(self, conversation):
+        fork = self._fork()
+        for message in conversation_messages(conversation):
+            if message["role"] == "system":
+                fork.set_system_message(message["content"])
+            else:
+                fork.history.append(message)
+        return fork
+
+    def _uses_batch_api(self, use_batch_api, kwargs):
+        # Structured calls need their schema, repairs and validation, which only the
+        # regular request path applies, so they run through the concurrent executor.
+        return (
+            use_batch_api
+            and self.provider in BATCH_PROVIDERS
+            and kwargs.get("response_model") is None
+        )
+
+    def _batch_payload(self, conversations, kwargs):
+        kwargs = {k: v for k, v in kwargs.items() if k != "response_model"}
+        max_tokens, anthropic_max_tokens, _ = self._prepare_request(kwargs)
+        system_message = content_text(self.system_message)
+        if self.provider == "openai":
+            if self.json_mode:
+                kwargs = {"response_format": {"type": "json_object"}, **kwargs}
+            return openai_batch_lines(
+                self.model, system_message, conversations, max_tokens, kwargs
+            )
+        return anthropic_batch_requests(
+            self.model, system_message, conversations, anthropic_max_tokens, kwargs
+        )
+
+    def _collate_batch_results(self, results, record_started, return_exceptions):
+        responses = []
+        for result in results:
+            record = self._start_record(False)
+            record._clock = record_started
+            if result.error is not None:
+                self._finish_record(record, result.error)
+                if not return_exceptions:
+                    raise result.error
+                responses.append(result.error)
+                continue
+            self._record_usage(record, SimpleNamespace(**result.usage))
+            try:
+                response = self._decode_response(result.text)
+            except (TypeError, ValueError) as e:
+                # A reply that is not valid JSON fails only its own item.
+                self._finish_record(record, e)
+                if not return_exceptions:
+                    raise
+                responses.append(e)
+                continue
+            self._finish_record(record)
+            responses.append(response)
+        return responses
+
+    def chat_many(
+        self,
+        conversations,
+        max_concurrency=8,
+        use_batch_api=False,
+        poll_interval=30,
+        batch_timeout=24 * 3600,
+        return_exceptions=False,
+        **kwargs,
+    ):
+        conversations = list(conversations)
+        if self.use_async:
+            return asyncio.run(
+                self.chat_many_async(
+                    conversations,
+                    max_concurrency=max_concurrency,
+                    use_batch_api=use_batch_api,
+                    poll_interval=poll_interval,
+                    batch_timeout=batch_timeout,
+                    return_exceptions=return_exceptions,
+                    **kwargs,
+                )
+            )
+
+        if self._uses_batch_api(use_batch_api, kwargs):
+            started = time.monotonic()
+            payload = self._batch_payload(conversations, kwargs)
+            runner = (
+                run_openai_batch if self.provider == "openai" else run_anthropic_batch
+            )
+            results = runner(
+                self.client, payload, len(conversations), poll_interval, batch_timeout
+            )
+            return self._collate_batch_results(results, started, return_exceptions)
+
+        def run(conversation):
+            fork = self._load_conversation(conversation)
+            return fork.get_response(should_print=False, **kwargs)
+
+        responses = []
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            futures = [pool.submit(run, conversation) for conversation in conversations]
+            for future in futures:
+                try:
+                    responses.append(future.result())
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    responses.append(e)
+        return responses
+
+    async def chat_many_async(
+        self,
+        conversations,
+        max_concurrency=8,
+        use_batch_api=False,
+        poll_interval=30,
+        batch_timeout=24 * 3600,
+        return_exceptions=False,
+        **kwargs,
+    ):
+        conversations = list(conversations)
+        if self._uses_batch_api(use_batch_api, kwargs):
+            started = time.monotonic()
+            payload = self._batch_payload(conversations, kwargs)
+            if not self.use_async:
+                runner = (
+                    run_openai_batch
+                    if self.provider == "openai"
+                    else run_anthropic_batch
+                )
+                results = await asyncio.to_thread(
+                    runner,
+                    self.client,
+                    payload,
+                    len(conversations),
+                    poll_interval,
+                    batch_timeout,
+                )
+            else:
+                runner = (
+                    run_openai_batch_async
+                    if self.provider == "openai"
+                    else run_anthropic_batch_async
+                )
+                results = await runner(
+                    self.client,
+                    payload,
+                    len(conversations),
+                    poll_interval,
+                    batch_timeout,
+                )
+            return self._collate_batch_results(results, started, return_exceptions)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(conversation):
+            async with semaphore:
+                fork = self._load_conversation(conversation)
+                if self.use_async:
+                    return await fork.get_response_async(should_print=False, **kwargs)
+                return await asyncio.to_thread(
+                    fork.get_response, should_print=False, **kwargs
+                )
+
+        return await asyncio.gather(
+            *[run(conversation) for conversation in conversations],
+            return_exceptions=return_exceptions,
+        )
 
     """
 instructions for the AI using unified to build apps:
@@ -455,5 +1531,5 @@ when using json mode set json_mode=True and descibe the json object needed to th
 Always use default models unless otherwise specified
 don't use caching
 when using claude system message is inserted as an api parameter
-when using claude instrcut it to return parsable structured content in <> tags for easier parsing, use string or regex methods to parse it
+for structured output with any provider pass a pydantic model as response_model; it is sent as a tool/function schema and validated
 """